@@ -0,0 +1,126 @@
+"""
+Compare the chunk counts and embedding tokens of the character splitter and the token chunker.
+
+Every input is split with the 500 characters splitter used before token chunking, and with the
+token chunker at each of the given sizes. For every splitter the number of chunks and embedding
+model tokens per MB of text are reported, which is what ingestion pays the embedding API for
+(overlaps included), along with the token length of the chunks and the splitting throughput.
+Inputs are text files, PDFs (read with PyMuPDF) or, by default, synthetic prose.
+
+The tokenizer of the embedding model is downloaded by tiktoken on first use.
+
+Usage (from the backend directory):
+    python -m benchmarks.chunker_benchmark --files notes.txt,report.pdf --sizes 128:16,256:32,512:64
+"""
+import argparse
+import json
+import time
+import numpy as np
+from benchmarks.vector_memory_benchmark import make_vocabulary, make_text
+from handlers.vectorization.chunker import text_splitter, iter_token_chunks, count_tokens, get_encoder
+
+def read_file(path: str) -> str:
+    """
+    Read the text of an input file.
+
+    Args:
+        path (str): The path of a text file or a PDF.
+
+    Returns:
+        str: The text.
+    """
+    if path.lower().endswith(".pdf"):
+        import fitz
+        with fitz.open(path) as pdf:
+            return "\n\n".join(page.get_text() for page in pdf)
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+def make_corpus(size: int, seed: int) -> str:
+    """
+    Generate synthetic prose: paragraphs of a few sentences of Zipf distributed words.
+
+    Args:
+        size (int): The approximate number of characters.
+        seed (int): The random seed.
+
+    Returns:
+        str: The text.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(5000, rng)
+    paragraphs, length = [], 0
+    while length < size:
+        sentences = [make_text(vocabulary, rng).capitalize() + "." for _ in range(rng.integers(2, 8))]
+        paragraphs.append(" ".join(sentences))
+        length += len(paragraphs[-1]) + 2
+    return "\n\n".join(paragraphs)
+
+def measure(name: str, split, text: str, encoder) -> dict:
+    """
+    Split a text and measure the chunks.
+
+    Args:
+        name (str): The name of the splitter in the report.
+        split: A function text -> iterable of chunk texts.
+        text (str): The text.
+        encoder: The tokenizer of the embedding model.
+
+    Returns:
+        dict: The results of the splitter.
+    """
+    started = time.perf_counter()
+    chunks = [chunk.strip() for chunk in split(text)]
+    seconds = time.perf_counter() - started
+    chunks = [chunk for chunk in chunks if chunk]
+    tokens = np.array([count_tokens(chunk, encoder) for chunk in chunks])
+    megabytes = len(text.encode("utf-8")) / 2**20
+    return {
+        "splitter": name,
+        "chunks": len(chunks),
+        "chunks_per_mb": len(chunks) / megabytes,
+        "tokens_per_mb": float(tokens.sum()) / megabytes,
+        "text_tokens_per_mb": count_tokens(text, encoder) / megabytes,
+        "mean_chunk_tokens": float(tokens.mean()),
+        "max_chunk_tokens": int(tokens.max()),
+        "mb_per_second": megabytes / seconds,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", help="Comma separated text or PDF files, synthetic prose by default")
+    parser.add_argument("--sizes", default="128:16,256:32,512:64", help="Comma separated size:overlap token chunker settings")
+    parser.add_argument("--synthetic-mb", type=float, default=2, help="Size of the synthetic corpus in MB")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic corpus")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    encoder = get_encoder()
+    inputs = (
+        [(path, read_file(path)) for path in args.files.split(",")]
+        if args.files
+        else [("synthetic", make_corpus(int(args.synthetic_mb * 2**20), args.seed))]
+    )
+    splitters = [("characters 500/100", text_splitter.split_text)] + [
+        (f"tokens {size}/{overlap}", lambda text, size=size, overlap=overlap: iter_token_chunks(text, size, overlap, encoder))
+        for size, overlap in (tuple(int(value) for value in setting.split(":")) for setting in args.sizes.split(","))
+    ]
+
+    results = []
+    for name, text in inputs:
+        print(f"{name}: {len(text.encode('utf-8')) / 2**20:.2f} MB, {count_tokens(text, encoder)} tokens")
+        print(f"  {'splitter':<20}{'chunks':>8}{'chunks/MB':>11}{'tokens/MB':>11}{'mean tok':>10}{'max tok':>9}{'MB/s':>8}")
+        for splitter, split in splitters:
+            result = {"input": name, **measure(splitter, split, text, encoder)}
+            results.append(result)
+            print(
+                f"  {splitter:<20}{result['chunks']:>8}{result['chunks_per_mb']:>11.0f}{result['tokens_per_mb']:>11.0f}"
+                f"{result['mean_chunk_tokens']:>10.1f}{result['max_chunk_tokens']:>9}{result['mb_per_second']:>8.2f}"
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
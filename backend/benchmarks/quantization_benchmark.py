@@ -0,0 +1,135 @@
+"""
+Compare the memory footprint and recall of the FAISS_COMPRESSION options.
+
+Builds every compression of the chosen index type over the same synthetic, clustered vectors and
+reports the serialized index size, the memory saved against uncompressed vectors, and the recall@k
+against an exact search, both straight from the compressed index and after re-ranking
+`k * FAISS_RERANK_FACTOR` candidates with the full precision vectors.
+
+Usage (from the backend directory):
+    python -m benchmarks.quantization_benchmark --vectors 20000 --dim 1536 --index-type ivf
+"""
+import argparse
+import json
+import math
+import time
+import faiss
+import numpy as np
+from handlers.vectorization.index_factory import INDEX_TYPES, COMPRESSION_TYPES, get_factory_string, search_parameters, rerank
+from handlers.vectorization.full_vectors import FullVectorStore
+from utils.env_vars import FAISS_RERANK_FACTOR
+
+def make_vectors(count: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """
+    Generate unit length vectors grouped around random centres, roughly like text embeddings.
+
+    Args:
+        count (int): The number of vectors.
+        dim (int): The dimension of the vectors.
+        clusters (int): The number of cluster centres.
+        seed (int): The random seed.
+
+    Returns:
+        np.ndarray: A (count, dim) float32 array.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, count)] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def recall(expected: np.ndarray, found: np.ndarray) -> float:
+    hits = sum(len(set(expected_row) & set(found_row)) for expected_row, found_row in zip(expected, found))
+    return hits / expected.size
+
+def benchmark(vectors: np.ndarray, queries: np.ndarray, index_type: str, k: int, rerank_factor: int) -> list:
+    """
+    Build and search every compression of an index type.
+
+    Args:
+        vectors (np.ndarray): The vectors to index.
+        queries (np.ndarray): The query vectors.
+        index_type (str): One of INDEX_TYPES.
+        k (int): The number of neighbours to compare.
+        rerank_factor (int): The number of candidates fetched per result when re-ranking.
+
+    Returns:
+        list: One result dict per compression.
+    """
+    dim = vectors.shape[1]
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(vectors)
+    _, expected = exact.search(queries, k)
+
+    full_vectors = FullVectorStore(vectors)
+    raw_bytes = vectors.nbytes
+    nlist = max(1, min(int(4 * math.sqrt(len(vectors))), len(vectors) // 39))
+    training = vectors[np.random.default_rng(0).permutation(len(vectors))[:256 * max(nlist, 256)]]
+
+    results = []
+    for compression in COMPRESSION_TYPES:
+        factory = get_factory_string(dim, index_type, compression, nlist)
+        index = faiss.index_factory(dim, factory, faiss.METRIC_L2)
+
+        started = time.perf_counter()
+        if not index.is_trained:
+            index.train(training)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - started
+
+        params = search_parameters(index)
+        started = time.perf_counter()
+        _, found = index.search(queries, k, params=params)
+        search_ms = 1000 * (time.perf_counter() - started) / len(queries)
+
+        started = time.perf_counter()
+        _, candidates = index.search(queries, k * rerank_factor, params=params)
+        _, reranked = rerank(queries, candidates, full_vectors, k)
+        rerank_ms = 1000 * (time.perf_counter() - started) / len(queries)
+
+        index_bytes = len(faiss.serialize_index(index))
+        results.append({
+            "compression": compression,
+            "factory": factory,
+            "index_bytes": index_bytes,
+            "memory_saved": 1 - index_bytes / raw_bytes,
+            "recall": recall(expected, found),
+            "recall_reranked": recall(expected, reranked),
+            "build_seconds": build_seconds,
+            "search_ms": search_ms,
+            "rerank_search_ms": rerank_ms,
+        })
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20000, help="Number of indexed vectors")
+    parser.add_argument("--dim", type=int, default=1536, help="Vector dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--clusters", type=int, default=100, help="Number of clusters in the synthetic data")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="Index type combined with every compression")
+    parser.add_argument("-k", type=int, default=10, help="Number of neighbours compared for recall")
+    parser.add_argument("--rerank-factor", type=int, default=FAISS_RERANK_FACTOR, help="Candidates fetched per result when re-ranking")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.vectors, args.dim, args.clusters)
+    queries = make_vectors(args.queries, args.dim, args.clusters, seed=1)
+    results = benchmark(vectors, queries, args.index_type, args.k, args.rerank_factor)
+
+    baseline = results[0]
+    print(f"{args.vectors} vectors x {args.dim} dims ({vectors.nbytes / 2**20:.1f} MiB raw), recall@{args.k}, re-rank x{args.rerank_factor}")
+    print(f"{'factory':<18}{'index MiB':>10}{'saved':>8}{'recall':>8}{'lost':>8}{'reranked':>10}{'lost':>8}{'ms/q':>8}{'rr ms/q':>9}")
+    for result in results:
+        print(
+            f"{result['factory']:<18}{result['index_bytes'] / 2**20:>10.1f}{result['memory_saved']:>8.1%}"
+            f"{result['recall']:>8.3f}{baseline['recall'] - result['recall']:>8.3f}"
+            f"{result['recall_reranked']:>10.3f}{baseline['recall'] - result['recall_reranked']:>8.3f}"
+            f"{result['search_ms']:>8.2f}{result['rerank_search_ms']:>9.2f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Measure the latency, memory and disk footprint of the vector memory layer at several corpus sizes.
+
+For every size, a synthetic multi-tenant corpus is written into a fresh FAISS_INDEX_DIR with the
+deterministic `hashing` embedder, so no embedding API is called and runs are reproducible. Tenant
+sizes are skewed like real usage: a few users hold most of the memories. Once every shard is
+seeded and compacted, `add_memory`, `search_memory`, `get_all_memories` and `delete_memory` are
+timed through `VectorMemoryTools` on randomly picked tenants, which exercises the same code path as
+the API and the agents. Every size runs in its own process so that its peak RSS is not inflated by
+the previous one.
+
+Usage (from the backend directory):
+    python -m benchmarks.vector_memory_benchmark --sizes 10000,100000,1000000 --json vector_memory.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+import numpy as np
+
+# Vectors embedded and appended per WAL write while seeding
+SEED_BATCH_SIZE = 1000
+OPERATIONS = ("add_memory", "search_memory", "get_all_memories", "delete_memory")
+
+def make_vocabulary(size: int, rng: np.random.Generator) -> list:
+    """
+    Generate pronounceable fake words, so texts share terms the way natural language does.
+
+    Args:
+        size (int): The number of words.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        list: The words.
+    """
+    consonants, vowels = list("bcdfghjklmnprstvz"), list("aeiou")
+    return [
+        "".join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.integers(1, 4)))
+        for _ in range(size)
+    ]
+
+def make_text(vocabulary: list, rng: np.random.Generator) -> str:
+    """
+    Generate one memory: a sentence of Zipf distributed words followed by a unique identifier.
+
+    Args:
+        vocabulary (list): The words to draw from, most frequent first.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        str: The text of the memory.
+    """
+    ranks = np.minimum(rng.zipf(1.3, rng.integers(8, 30)), len(vocabulary)) - 1
+    return f"{' '.join(vocabulary[rank] for rank in ranks)} ref {rng.integers(1 << 40):x}"
+
+def tenant_sizes(total: int, tenants: int, rng: np.random.Generator) -> list:
+    """
+    Split a corpus between tenants with a heavy-tailed distribution.
+
+    Args:
+        total (int): The number of memories in the corpus.
+        tenants (int): The number of tenants.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        list: The number of memories of every tenant, summing to `total`.
+    """
+    weights = rng.pareto(1.5, tenants) + 1
+    sizes = np.floor(weights / weights.sum() * total).astype(int)
+    sizes[np.argmax(sizes)] += total - sizes.sum()
+    return sizes.tolist()
+
+def percentiles(timings: list) -> dict:
+    milliseconds = 1000 * np.asarray(timings)
+    return {
+        "count": len(timings),
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "max_ms": float(milliseconds.max()),
+    }
+
+def directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+def peak_rss() -> int:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def run_size(size: int, args: dict) -> dict:
+    """
+    Seed a corpus of the given size and time the memory operations on it, in a fresh process.
+
+    Args:
+        size (int): The number of memories in the corpus.
+        args (dict): The parsed command line arguments.
+
+    Returns:
+        dict: The results for this size.
+    """
+    data_dir = tempfile.mkdtemp(prefix=f"vector-memory-{size}-", dir=args["data_dir"])
+    # The handlers read their configuration when imported, so it is set before importing them
+    os.environ["FAISS_INDEX_DIR"] = data_dir
+    os.environ["EMBEDDING_BACKEND"] = "hashing"
+    os.environ["EMBEDDING_DIMENSIONS"] = str(args["dim"])
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+    from handlers.vectorization.embedders import embedder
+    from handlers.vectorization.faiss_handler import get_shard_dir, with_created_at
+    from handlers.vectorization.index_manager import index_manager
+    from handlers.tools.vector_memory import VectorMemoryTools
+    from langchain_core.documents import Document
+
+    rng = np.random.default_rng(args["seed"])
+    vocabulary = make_vocabulary(args["vocabulary"], rng)
+    sizes = tenant_sizes(size, args["tenants"], rng)
+
+    started = time.perf_counter()
+    known_ids = {}
+    for user_id, count in enumerate(sizes):
+        shard = index_manager.get_shard(get_shard_dir(user_id))
+        for start in range(0, count, SEED_BATCH_SIZE):
+            texts = [make_text(vocabulary, rng) for _ in range(min(SEED_BATCH_SIZE, count - start))]
+            documents = [Document(page_content=text, metadata={"source": "user_input", "user_id": user_id}) for text in texts]
+            ids = shard.add(texts, embedder.embed_documents(texts), with_created_at(documents))
+            # Keep a few IDs per tenant to delete later, holding all of them would skew the RSS
+            known_ids.setdefault(user_id, []).extend(ids[:args["operations"]])
+        shard.compact()
+    seed_seconds = time.perf_counter() - started
+    seeded_rss = peak_rss()
+
+    timings = {operation: [] for operation in OPERATIONS}
+    tenants = [user_id for user_id, count in enumerate(sizes) if count > 0]
+    for _ in range(args["operations"]):
+        user_id = int(rng.choice(tenants))
+        tools = VectorMemoryTools(user_id)
+        text = make_text(vocabulary, rng)
+        query = " ".join(text.split()[:4])
+        doc_id = known_ids[user_id].pop() if known_ids[user_id] else None
+
+        for operation, call in (
+            ("add_memory", lambda: tools.add_memory(text)),
+            ("search_memory", lambda: tools.search_memory(query, k=args["k"])),
+            ("get_all_memories", tools.get_all_memories),
+            ("delete_memory", (lambda: tools.delete_memory(doc_id)) if doc_id else None),
+        ):
+            if call is None:
+                continue
+            started = time.perf_counter()
+            call()
+            timings[operation].append(time.perf_counter() - started)
+
+    result = {
+        "vectors": size,
+        "tenants": len(tenants),
+        "largest_tenant": max(sizes),
+        "seed_seconds": seed_seconds,
+        "operations": {operation: percentiles(values) for operation, values in timings.items() if values},
+        "seeded_peak_rss_bytes": seeded_rss,
+        "peak_rss_bytes": peak_rss(),
+        "disk_bytes": directory_size(data_dir),
+    }
+    if not args["keep"]:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return result
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma separated corpus sizes")
+    parser.add_argument("--tenants", type=int, default=100, help="Number of users sharing the corpus")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding dimension")
+    parser.add_argument("--operations", type=int, default=200, help="Number of timed calls of every operation")
+    parser.add_argument("-k", type=int, default=5, help="Number of results per search")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="Number of distinct words in the synthetic texts")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--data-dir", help="Directory the corpora are written to, a temporary directory by default")
+    parser.add_argument("--keep", action="store_true", help="Keep the corpora on disk after the run")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # A fresh interpreter per size keeps peak RSS and the handlers' module level state independent
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size in (int(value) for value in args.sizes.split(",")):
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_size, (size, vars(args))))
+
+        result = results[-1]
+        print(
+            f"{result['vectors']} vectors, {result['tenants']} tenants (largest {result['largest_tenant']}), "
+            f"seeded in {result['seed_seconds']:.1f}s, peak RSS {result['peak_rss_bytes'] / 2**20:.0f} MiB, "
+            f"disk {result['disk_bytes'] / 2**20:.0f} MiB"
+        )
+        for operation, stats in result["operations"].items():
+            print(f"  {operation:<18}p50 {stats['p50_ms']:>9.2f} ms   p95 {stats['p95_ms']:>9.2f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
-from flask import Blueprint, request
+import os
+import tempfile
+from flask import Blueprint, request, current_app
 from services.document_service import DocumentService
 from controllers.utils import jsonify_ok, jsonify_error
 from utils.auth_middleware import require_signed_in
 from utils.auth_handlers import get_user_data
+from handlers.ingestion.document_ingestion import start_ingestion, get_job
 
 bp = Blueprint('documents', __name__, url_prefix='/documents')
 
@@ -61,3 +64,34 @@ def delete_document(doc_id):
         return jsonify_error('not found', 404)
     ok = DocumentService.delete(doc_id)
     return jsonify_ok() if ok else jsonify_error('not found', 404)
+
+@bp.route('/ingest', methods=['POST'])
+@require_signed_in
+def ingest_document():
+    user_id = get_current_user_id()
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify_error('file is required')
+    source = request.form.get('source', 'document')
+
+    # The upload is spooled to disk and read page by page by the ingestion worker
+    suffix = os.path.splitext(upload.filename)[1]
+    fd, path = tempfile.mkstemp(prefix='ingest-', suffix=suffix)
+    os.close(fd)
+    try:
+        upload.save(path)
+        doc = DocumentService.create(user_id=user_id, filename=upload.filename, source=source)
+        job = start_ingestion(current_app._get_current_object(), user_id, doc.id, path, upload.filename, source)
+    except Exception:
+        os.remove(path)
+        raise
+    return jsonify_ok(job.to_dict())
+
+@bp.route('/ingest/<job_id>', methods=['GET'])
+@require_signed_in
+def get_ingestion_job(job_id):
+    user_id = get_current_user_id()
+    job = get_job(job_id, user_id)
+    if not job:
+        return jsonify_error('not found', 404)
+    return jsonify_ok(job)
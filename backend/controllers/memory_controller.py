@@ -3,9 +3,16 @@ from controllers.utils import jsonify_ok, jsonify_error
 from utils.auth_middleware import require_signed_in
 from utils.auth_handlers import get_user_data
 from handlers.tools.vector_memory import VectorMemoryTools
+from handlers.vectorization.faiss_handler import FaissHandler, write_batcher
+from handlers.vectorization.chunker import ChunkerHandler
+from handlers.vectorization.query_cache import get_cache_stats
+from handlers.vectorization.embedders import get_embedding_stats
+from utils.env_vars import MEMORY_SEARCH_MODE
 
 bp = Blueprint('memories', __name__, url_prefix='/memories')
 
+MAX_PAGE_SIZE = 100
+
 def get_current_user_id():
     headers = request.headers
     jwt_bearer = headers.get('Authorization', '').split(' ')[1]
@@ -15,33 +22,32 @@ def get_current_user_id():
 @require_signed_in
 def list_memories():
     user_id = get_current_user_id()
-    page = int(request.args.get('page', 1))
-    limit = int(request.args.get('limit', 20))
-    offset = (page - 1) * limit
+    try:
+        limit = min(int(request.args.get('limit', 20)), MAX_PAGE_SIZE)
+        # Page numbers are still accepted for older clients, a cursor takes precedence
+        page = int(request.args.get('page', 1))
+    except ValueError:
+        return jsonify_error("limit and page must be integers", 400)
+    if limit < 1:
+        return jsonify_error("limit must be at least 1", 400)
+    if page < 1:
+        return jsonify_error("page must be at least 1", 400)
+    cursor = request.args.get('cursor') or None
+    offset = (page - 1) * limit if not cursor else 0
     q = request.args.get('q', '').strip()
+    mode = request.args.get('mode', MEMORY_SEARCH_MODE)
     
     try:
-        tools = VectorMemoryTools(user_id)
+        handler = FaissHandler(user_id)
         if q:
-            # When searching semantically, we don't necessarily want to reverse chronology
-            # as FAISS returns them by relevance score.
-            all_memories = tools.search_memory(q, limit=100)
-            if all_memories is None:
-                all_memories = []
+            # When searching semantically, results are ordered by relevance instead of reverse chronology
+            listing = handler.search_faiss_index_page(q, None, limit, cursor, offset, mode)
         else:
-            all_memories = tools.get_all_memories()
-            if all_memories is None:
-                all_memories = []
-            all_memories.reverse()
-            
-        total = len(all_memories)
-        
-        # Paginate the list of Document objects
-        paginated_docs = all_memories[offset:offset+limit]
+            listing = handler.list_documents_page(limit, cursor, offset)
         
         # Convert Document objects to dicts
         result = []
-        for doc in paginated_docs:
+        for doc in listing["documents"]:
             result.append({
                 "content": doc.page_content,
                 "metadata": doc.metadata
@@ -49,15 +55,23 @@ def list_memories():
             
         return jsonify_ok({
             "result": result,
-            "total": total,
+            "total": listing["total"],
+            "next_cursor": listing["next_cursor"],
             "page": page,
             "limit": limit
         })
+    except ValueError as e:
+        return jsonify_error(str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify_error(str(e))
 
+@bp.route('/cache-stats', methods=['GET'])
+@require_signed_in
+def cache_stats():
+    return jsonify_ok({**get_cache_stats(), "write_batches": write_batcher.stats(), "embeddings": get_embedding_stats()})
+
 @bp.route('/', methods=['POST'])
 @require_signed_in
 def add_memory():
@@ -70,8 +84,24 @@ def add_memory():
         
     try:
         # source = "user_input" is automatically assigned inside ChunkerHandler
-        VectorMemoryTools(user_id).add_memory(content)
-        return jsonify_ok()
+        stored = VectorMemoryTools(user_id).add_memory(content)
+        return jsonify_ok({**stored, "skipped": len(stored["duplicate_ids"])})
+    except Exception as e:
+        return jsonify_error(str(e))
+
+@bp.route('/', methods=['DELETE'])
+@require_signed_in
+def delete_memories():
+    user_id = get_current_user_id()
+    data = request.json or {}
+    memory_ids = data.get('ids')
+
+    if not memory_ids or not isinstance(memory_ids, list):
+        return jsonify_error("A list of memory ids is required.")
+
+    try:
+        deleted_ids = FaissHandler(user_id).delete_documents(memory_ids)
+        return jsonify_ok({"deleted": deleted_ids})
     except Exception as e:
         return jsonify_error(str(e))
 
@@ -99,9 +129,10 @@ def update_memory(memory_id):
         return jsonify_error("Memory content is required.")
         
     try:
-        # FAISS editing requires deletion of the old embedding UUID and immediate generation of a new one.
-        VectorMemoryTools(user_id).delete_memory(memory_id)
-        VectorMemoryTools(user_id).add_memory(content)
+        # FAISS editing requires deletion of the old embedding UUID and generation of a new one,
+        # both are written to the index as a single append.
+        documents = ChunkerHandler(user_id).split_documents(content)
+        FaissHandler(user_id).replace_document(memory_id, documents)
         return jsonify_ok()
     except Exception as e:
         return jsonify_error(str(e))
@@ -81,8 +81,9 @@ def get_system_prompt(agent_type: str = "supervisor") -> str:
         Your ONLY job is to store and retrieve unstructured facts, conversation summaries, and general knowledge in Vector Memory.
         
         ### Available Tools:
-        - **add_memory(memory_text)**: Store important extracted facts (goals, preferences, summaries).
-        - **search_memory(query)**: Retrieve relevant information. Always try multiple search queries (synonyms) if the first fails. Limit results to 15.
+        - **add_memory(memory_text)**: Store important extracted facts (goals, preferences, summaries). Facts that repeat a stored memory are skipped and reported as `duplicate_ids`.
+        - **search_memory(query)**: Retrieve relevant information. Matches both meaning and exact names, dates and IDs, so one search is usually enough. Limit results to 15.
+        - **search_memories(queries)**: Retrieve relevant information for several search queries at once. Prefer this over repeated `search_memory` calls when trying synonyms or rephrasings. Pass at most 10 queries per call. Limit results to 15 per query.
 
         - Do not manage structured tables (Projects, People, Decisions).
         """,
@@ -0,0 +1,251 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from models import db
+from models.chunk import Chunk
+from services.document_service import DocumentService
+from handlers.ingestion.page_splitter import page_splitter
+from handlers.vectorization.faiss_handler import FaissHandler
+from utils.env_vars import INGEST_BATCH_SIZE, INGEST_MAX_JOBS
+
+PDF_EXTENSIONS = (".pdf",)
+# Plain text files are read in blocks of this many characters, each block is processed like a PDF page
+TEXT_BLOCK_SIZE = 64 * 1024
+# Finished jobs are forgotten by the worker past this many, their final state stays on the document
+MAX_TRACKED_JOBS = 1000
+
+class IngestionJob:
+    """
+    Progress of the ingestion of one uploaded file into a document, its chunks and the vector memory.
+    """
+
+    def __init__(self, user_id, document_id: int, filename: str, source: str):
+        # Prefixed with the document ID, so any worker can find the job's persisted state
+        self.id = f"{document_id}-{uuid.uuid4().hex}"
+        self.user_id = user_id
+        self.document_id = document_id
+        self.filename = filename
+        self.source = source
+        self.status = "queued"
+        self.pages_total = None
+        self.pages_done = 0
+        self.chunks = 0
+        self.duplicates = 0
+        self.error = None
+        self.created_at = datetime.now(timezone.utc).isoformat()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "document_id": self.document_id,
+            "filename": self.filename,
+            "source": self.source,
+            "status": self.status,
+            "pages_total": self.pages_total,
+            "pages_done": self.pages_done,
+            "chunks": self.chunks,
+            "duplicates": self.duplicates,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+# Jobs of this worker, by ID. Other workers read the state persisted on the document instead.
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+# Ingestion runs off the request workers, with a bound on the number of files processed at once
+executor = ThreadPoolExecutor(max_workers=INGEST_MAX_JOBS, thread_name_prefix="document-ingestion")
+
+def start_ingestion(app, user_id, document_id: int, path: str, filename: str, source: str) -> IngestionJob:
+    """
+    Queue the ingestion of an uploaded file in the background.
+
+    Args:
+        app: The Flask application, the job runs inside its app context.
+        user_id: The ID of the user owning the document.
+        document_id (int): The ID of the document the chunks belong to.
+        path (str): The path of the uploaded file on disk, deleted once the job finishes.
+        filename (str): The original name of the file, its extension selects the reader.
+        source (str): The source stored on the chunks' memories.
+
+    Returns:
+        IngestionJob: The queued job.
+    """
+    job = IngestionJob(user_id, document_id, filename, source)
+    with jobs_lock:
+        jobs[job.id] = job
+        while len(jobs) > MAX_TRACKED_JOBS:
+            oldest_id = next((job_id for job_id, tracked in jobs.items() if tracked.finished_at), None)
+            if oldest_id is None:
+                break
+            jobs.pop(oldest_id)
+    save_progress(job)
+    executor.submit(run_ingestion, app, job, path)
+    return job
+
+def get_job(job_id: str, user_id) -> dict | None:
+    """
+    Get the progress of an ingestion job of a user.
+
+    Args:
+        job_id (str): The ID of the job.
+        user_id: The ID of the user asking, jobs of other users are not returned.
+
+    Returns:
+        dict | None: The state of the job, or None if the user has no such job.
+    """
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is not None:
+        return job.to_dict() if job.user_id == user_id else None
+
+    # Started by another worker, or before a restart
+    document_id, _, _ = job_id.partition("-")
+    if not document_id.isdigit():
+        return None
+    document = DocumentService.get(int(document_id))
+    if document is None or str(document.user_id) != str(user_id):
+        return None
+    state = (document.additional_info or {}).get("ingestion")
+    return state if state and state.get("job_id") == job_id else None
+
+def save_progress(job: IngestionJob) -> None:
+    """
+    Persist the state of a job on its document.
+
+    Args:
+        job (IngestionJob): The job.
+    """
+    document = DocumentService.get(job.document_id)
+    if document is None:
+        return
+    # JSON columns only detect reassignment, not in-place changes
+    document.additional_info = {**(document.additional_info or {}), "ingestion": job.to_dict()}
+    db.session.commit()
+
+def iter_pages(path: str, filename: str):
+    """
+    Read a file page by page, without loading it whole.
+
+    Args:
+        path (str): The path of the file.
+        filename (str): The original name of the file, PDFs are read with PyMuPDF, everything else as UTF-8 text.
+
+    Yields:
+        tuple: The page count (None when unknown) first, then (page number, text) for every page, from 1.
+            The text of PDF pages is None, it is extracted by the page splitter's processes.
+    """
+    if filename.lower().endswith(PDF_EXTENSIONS):
+        import fitz
+        with fitz.open(path) as pdf:
+            page_count = pdf.page_count
+        yield page_count
+        for number in range(page_count):
+            yield number + 1, None
+        return
+
+    yield None
+    number, carry = 0, ""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            block = f.read(TEXT_BLOCK_SIZE)
+            if not block:
+                break
+            text = carry + block
+            # Cut at the last line break so that no line is split between two blocks
+            cut = text.rfind("\n")
+            if cut <= 0:
+                cut = len(text)
+            number += 1
+            yield number, text[:cut]
+            carry = text[cut:]
+    if carry.strip():
+        yield number + 1, carry
+
+def run_ingestion(app, job: IngestionJob, path: str) -> None:
+    """
+    Run an ingestion job and record its outcome, deleting the uploaded file afterwards.
+
+    Args:
+        app: The Flask application.
+        job (IngestionJob): The job.
+        path (str): The path of the uploaded file.
+    """
+    with app.app_context():
+        try:
+            job.status = "running"
+            save_progress(job)
+            ingest_file(job, path)
+            job.status = "done"
+        except Exception as e:
+            print(f"Error ingesting document {job.document_id} ({job.filename}): {e}")
+            db.session.rollback()
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now(timezone.utc).isoformat()
+            try:
+                save_progress(job)
+            finally:
+                os.remove(path)
+
+def ingest_file(job: IngestionJob, path: str) -> None:
+    """
+    Chunk a file page by page, embed the chunks in batches, store them in the vector memory and
+    bulk insert their `Chunk` rows. Pages are extracted and chunked in parallel by the page splitter,
+    and only a few pages and one batch of chunks are held in memory.
+
+    Args:
+        job (IngestionJob): The job, updated as pages are processed.
+        path (str): The path of the file.
+    """
+    pages = iter_pages(path, job.filename)
+    job.pages_total = next(pages)
+
+    batch = []
+    for page_number, docs in page_splitter.split(job.user_id, job.source, path, pages):
+        for doc in docs:
+            doc.metadata.update({"document_id": job.document_id, "page": page_number, "chunk_index": job.chunks + len(batch)})
+            batch.append(doc)
+            if len(batch) >= INGEST_BATCH_SIZE:
+                store_chunks(job, batch)
+                batch = []
+        job.pages_done = page_number
+    store_chunks(job, batch)
+
+def store_chunks(job: IngestionJob, batch: list) -> None:
+    """
+    Add a batch of chunks to the vector memory with a single write and insert their rows.
+
+    Args:
+        job (IngestionJob): The job the chunks belong to.
+        batch (list): The chunk documents, with their page and chunk index in the metadata.
+    """
+    if not batch:
+        return
+    handler = FaissHandler(job.user_id)
+    results = handler.index_documents(batch)
+    try:
+        db.session.execute(db.insert(Chunk), [
+            {
+                "document_id": job.document_id,
+                "user_id": job.user_id,
+                "text": doc.page_content,
+                "chunk_index": doc.metadata["chunk_index"],
+                "additional_info": {"memory_id": memory_id, "page": doc.metadata["page"], "duplicate": duplicate},
+            }
+            for doc, (memory_id, duplicate) in zip(batch, results)
+        ])
+        job.chunks += len(batch)
+        job.duplicates += sum(duplicate for _, duplicate in results)
+        # Commits the chunk rows together with the progress
+        save_progress(job)
+    except Exception:
+        # Without their rows the new memories would be taken for duplicates by a retry, drop them too
+        db.session.rollback()
+        handler.delete_documents(list({memory_id for memory_id, duplicate in results if not duplicate}))
+        raise
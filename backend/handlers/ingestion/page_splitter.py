@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from handlers.vectorization.chunker import ChunkerHandler
+from utils.env_vars import INGEST_PROCESSES
+
+# Pages split by one task of the pool, which opens the PDF once for all of them
+PAGES_PER_TASK = 8
+
+class PdfPages:
+    """
+    Reads pages of a PDF, opening it on the first page read and closing it with the context.
+
+    PyMuPDF documents must not be shared between threads, every split opens its own.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.document = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.document is not None:
+            self.document.close()
+            self.document = None
+
+    def read(self, page_number: int) -> str:
+        """
+        Extract the text of one page.
+
+        Args:
+            page_number (int): The number of the page, from 1.
+
+        Returns:
+            str: The text of the page.
+        """
+        if self.document is None:
+            import fitz
+            self.document = fitz.open(self.path)
+        return self.document.load_page(page_number - 1).get_text()
+
+def split_pages(user_id, source: str, path: str, pages: list) -> list:
+    """
+    Extract the text of consecutive pages if needed and split them into chunks. Runs in the pool's processes.
+
+    Args:
+        user_id: The ID of the user owning the document.
+        source (str): The source stored in the chunks' metadata.
+        path (str): The path of the PDF, used for the pages without text.
+        pages (list): (page number, text) tuples, text being None to extract it from the PDF.
+
+    Returns:
+        list: (page number, chunk documents) for every page, in order.
+    """
+    chunker = ChunkerHandler(user_id)
+    # The PDF is closed before returning, so nothing stays open once the upload is deleted
+    with PdfPages(path) as pdf:
+        return [
+            (page_number, chunker.split_documents(pdf.read(page_number) if text is None else text, source))
+            for page_number, text in pages
+        ]
+
+class PageSplitter:
+    """
+    Fans page extraction and chunking out over a bounded pool of processes.
+
+    PyMuPDF extraction and text splitting are CPU bound and hold the GIL, so threads do not help.
+    Pages are submitted in tasks of PAGES_PER_TASK consecutive pages, a few tasks at a time, and
+    their chunks are yielded in page order, which keeps the numbering of the chunks stable and bounds
+    the pages held in memory, whatever the order in which the processes finish them.
+    """
+
+    def __init__(self, processes: int = INGEST_PROCESSES):
+        """
+        Args:
+            processes (int): The number of worker processes, 0 uses one per CPU and 1 splits in the calling thread.
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Forking a process that runs request and batcher threads can copy held locks, spawn starts clean
+                self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def split(self, user_id, source: str, path: str, pages):
+        """
+        Split the pages of a file into chunks.
+
+        Args:
+            user_id: The ID of the user owning the document.
+            source (str): The source stored in the chunks' metadata.
+            path (str): The path of the file.
+            pages: An iterable of (page number, text) tuples, text being None for the PDF pages to extract in the pool.
+
+        Yields:
+            tuple: (page number, iterable of chunk documents) for every page, in the order of `pages`.
+        """
+        if self.processes == 1:
+            # Chunks are produced lazily, as the ingestion consumes them
+            chunker = ChunkerHandler(user_id)
+            with PdfPages(path) as pdf:
+                for page_number, text in pages:
+                    yield page_number, chunker.iter_documents(pdf.read(page_number) if text is None else text, source)
+            return
+
+        pool = self._get_pool()
+        pending = deque()
+        try:
+            for task in self._tasks(pages):
+                pending.append(pool.submit(split_pages, user_id, source, path, task))
+                # Keep every process busy with a task in reserve, without reading ahead the whole file
+                if len(pending) >= 2 * self.processes:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # The job failed or stopped reading, drop the tasks not started yet
+            for future in pending:
+                future.cancel()
+
+    def _tasks(self, pages):
+        task = []
+        for page in pages:
+            task.append(page)
+            if len(task) >= PAGES_PER_TASK:
+                yield task
+                task = []
+        if task:
+            yield task
+
+page_splitter = PageSplitter()
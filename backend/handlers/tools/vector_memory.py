@@ -1,5 +1,9 @@
 from handlers.vectorization.faiss_handler import FaissHandler
 from handlers.vectorization.chunker import ChunkerHandler
+from utils.env_vars import MEMORY_SEARCH_MODE
+
+# Number of queries a single search_memories call runs
+MAX_SEARCH_QUERIES = 10
 
 class VectorMemoryTools:
     def __init__(self, user_id):
@@ -13,15 +17,14 @@ class VectorMemoryTools:
             text (str): The text to be added to the vector memory.
             
         Returns:
-            None
+            dict: The IDs of the stored memory chunks ("ids"), and the IDs of existing memories that
+                  chunks were skipped for because they repeat them ("duplicate_ids").
         """
 
         documents = ChunkerHandler(self.user_id).split_documents(text)
-        memory_index = FaissHandler(self.user_id).create_faiss_index(documents)
-
-        return memory_index
+        return FaissHandler(self.user_id).create_faiss_index(documents)
 
-    def search_memory(self, query: str, source: str = None, k: int = 5):
+    def search_memory(self, query: str, source: str = None, k: int = 5, mode: str = MEMORY_SEARCH_MODE):
         """
         Search the vector memory for relevant documents.
         
@@ -30,6 +33,8 @@ class VectorMemoryTools:
             source (str): The source of the query.
             user_id (int): The ID of the user for whom the search is being performed.
             k (int): The number of top results to return.
+            mode (str): "hybrid" (default) matches both meaning and exact words such as names, dates and IDs,
+                        "vector" matches meaning only, "lexical" matches exact words only.
             
         Returns:
             list: A list of the top k documents matching the query.
@@ -38,7 +43,29 @@ class VectorMemoryTools:
         if k > 15:
             k = 15
 
-        results = FaissHandler(self.user_id).search_faiss_index(query, source, k)
+        results = FaissHandler(self.user_id).search_faiss_index(query, source, k, mode)
+        return results
+
+    def search_memories(self, queries: list[str], source: str = None, k: int = 5):
+        """
+        Search the vector memory with several queries (e.g. synonyms or rephrasings) in one call.
+
+        Args:
+            queries (list[str]): The search queries, at most 10. Passing more raises an error, split them over several calls.
+            source (str): The source of the query.
+            k (int): The number of top results to return per query.
+
+        Returns:
+            list: The merged, deduplicated documents, each with its per-query scores in the metadata.
+        """
+
+        if k > 15:
+            k = 15
+
+        if len(queries) > MAX_SEARCH_QUERIES:
+            raise ValueError(f"At most {MAX_SEARCH_QUERIES} queries can be searched at once, got {len(queries)}.")
+
+        results = FaissHandler(self.user_id).search_faiss_index_batch(queries, source, k)
         return results
 
     def get_all_memories(self):
@@ -62,4 +89,4 @@ class VectorMemoryTools:
             bool: True if deletion was successful.
         """
         return FaissHandler(self.user_id).delete_document(memory_id)
-    
\ No newline at end of file
+
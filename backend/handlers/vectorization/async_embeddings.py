@@ -0,0 +1,245 @@
+import asyncio
+import random
+import threading
+import time
+from langchain_core.embeddings import Embeddings
+from .rate_limit import RateLimiter, estimate_tokens
+
+# Limits of the OpenAI embeddings endpoint per request
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300000
+# Attempts of a request before its error is raised, and bounds of the exponential backoff between them
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+class AsyncEmbeddings(Embeddings):
+    """
+    Embeds texts with concurrent requests to an OpenAI compatible embeddings endpoint.
+
+    Inputs are split into batches of at most `batch_size` texts and `batch_tokens` estimated
+    tokens, and up to `max_in_flight` batches are requested at once from an asyncio event loop.
+    Every request first takes its share of the requests and tokens per minute budgets, the estimate
+    being corrected with the usage the API reports. A rate limited request halves the number of
+    requests allowed in flight and pauses new requests for the Retry-After the server sent, or an
+    exponential backoff with jitter; every `limit` successful requests then allow one more, back up
+    to `max_in_flight`. Connection errors, timeouts and server errors are retried with the same
+    backoff. `stats` exposes the request counters and throughput.
+
+    The requests run on a background event loop shared by all callers, so the synchronous
+    `embed_documents` can be called from several threads at once and `aembed_documents` from any
+    event loop.
+    """
+
+    def __init__(self, model: str, dimensions: int = 0, base_url: str = None, api_key: str = None,
+                 batch_size: int = MAX_BATCH_INPUTS, batch_tokens: int = MAX_BATCH_TOKENS,
+                 max_in_flight: int = 8, rpm: float = 0, tpm: float = 0, timeout: float = 60):
+        """
+        Args:
+            model (str): The embedding model.
+            dimensions (int): The dimension of the embeddings, 0 keeps the model's native dimension.
+            base_url (str): The URL of the API, None for OpenAI's or the OPENAI_BASE_URL environment variable.
+            api_key (str): The API key, None for the OPENAI_API_KEY environment variable.
+            batch_size (int): The maximum number of texts per request.
+            batch_tokens (int): The maximum number of estimated tokens per request.
+            max_in_flight (int): The maximum number of concurrent requests.
+            rpm (float): The requests per minute budget, 0 for no limit.
+            tpm (float): The tokens per minute budget, 0 for no limit.
+            timeout (float): The timeout of a request in seconds.
+        """
+        self.model = model
+        self.dimensions = dimensions
+        self.base_url = base_url or None
+        self.api_key = api_key
+        self.batch_size = min(batch_size, MAX_BATCH_INPUTS)
+        self.batch_tokens = min(batch_tokens, MAX_BATCH_TOKENS)
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.requests = RateLimiter(rpm)
+        self.tokens = RateLimiter(tpm)
+        self.limit = max_in_flight
+        self._in_flight = 0
+        self._successes = 0
+        self._paused_until = 0.0
+        self._loop = None
+        self._client = None
+        self._condition = None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "rate_limited": 0, "retries": 0, "failed": 0, "texts": 0, "tokens": 0, "request_seconds": 0.0}
+        self._first_request = None
+        self._last_response = None
+
+    def embed_documents(self, texts: list) -> list:
+        """
+        Embed a list of texts.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            list: The embedding of every text, in order.
+        """
+        if not texts:
+            return []
+        return asyncio.run_coroutine_threadsafe(self._embed(list(texts)), self._get_loop()).result()
+
+    def embed_query(self, text: str) -> list:
+        """
+        Embed a search query.
+
+        Args:
+            text (str): The query.
+
+        Returns:
+            list: The embedding of the query.
+        """
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list) -> list:
+        if not texts:
+            return []
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._embed(list(texts)), self._get_loop()))
+
+    async def aembed_query(self, text: str) -> list:
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self) -> dict:
+        """
+        Get the request counters and throughput of the executor.
+
+        Returns:
+            dict: The number of requests, rate limited and failed requests, retries, texts and tokens
+                embedded, the requests currently in flight and allowed in flight, the mean request
+                latency and the texts and tokens embedded per second since the first request.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            elapsed = (self._last_response - self._first_request) if self._first_request and self._last_response else 0
+        request_seconds = stats.pop("request_seconds")
+        return {
+            **stats,
+            "in_flight": self._in_flight,
+            "limit": self.limit,
+            "mean_latency_ms": 1000 * request_seconds / stats["requests"] if stats["requests"] else 0.0,
+            "texts_per_second": stats["texts"] / elapsed if elapsed > 0 else 0.0,
+            "tokens_per_second": stats["tokens"] / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def split_batches(self, texts: list) -> list:
+        """
+        Split texts into consecutive batches within the per request limits.
+
+        Args:
+            texts (list): The texts.
+
+        Returns:
+            list: (start, end) slices of `texts`.
+        """
+        batches, start, tokens = [], 0, 0
+        for position, text in enumerate(texts):
+            text_tokens = estimate_tokens(text)
+            if position > start and (position - start >= self.batch_size or tokens + text_tokens > self.batch_tokens):
+                batches.append((start, position))
+                start, tokens = position, 0
+            tokens += text_tokens
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="async-embeddings", daemon=True).start()
+            return self._loop
+
+    async def _embed(self, texts: list) -> list:
+        if self._client is None:
+            # Created on the executor's loop, which all requests run on
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, timeout=self.timeout, max_retries=0)
+            self._condition = asyncio.Condition()
+        results = await asyncio.gather(*(self._embed_batch(texts[start:end]) for start, end in self.split_batches(texts)))
+        return [vector for batch in results for vector in batch]
+
+    async def _embed_batch(self, texts: list) -> list:
+        from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+        estimate = sum(estimate_tokens(text) for text in texts)
+        for attempt in range(MAX_ATTEMPTS):
+            await self._acquire_slot()
+            try:
+                await asyncio.sleep(max(self.requests.reserve(1), self.tokens.reserve(estimate)))
+                started = time.monotonic()
+                with self._lock:
+                    self._first_request = self._first_request or started
+                response = await self._client.embeddings.create(
+                    input=texts,
+                    model=self.model,
+                    dimensions=self.dimensions or None,
+                    encoding_format="float",
+                )
+            except RateLimitError as e:
+                delay = self._backoff(attempt, e.response.headers.get("retry-after"))
+                self._on_rate_limited(delay)
+                error = e
+            except (APIConnectionError, APITimeoutError, InternalServerError) as e:
+                delay = self._backoff(attempt)
+                error = e
+            else:
+                self._on_success(len(texts), response.usage.prompt_tokens, estimate, time.monotonic() - started)
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            finally:
+                await self._release_slot()
+
+            if attempt == MAX_ATTEMPTS - 1:
+                with self._lock:
+                    self._stats["failed"] += 1
+                raise error
+            print(f"Error embedding {len(texts)} texts, retrying in {delay:.1f}s: {error}")
+            with self._lock:
+                self._stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Full jitter keeps clients that failed together from retrying together
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    async def _acquire_slot(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    async def _release_slot(self) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _on_rate_limited(self, delay: float) -> None:
+        # Back off multiplicatively: fewer requests in flight, and none sent until the server's delay is over
+        self.limit = max(1, self.limit // 2)
+        self._successes = 0
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        with self._lock:
+            self._stats["rate_limited"] += 1
+
+    def _on_success(self, texts: int, tokens: int, estimate: int, seconds: float) -> None:
+        # Charge the tokens budget with the actual usage instead of the estimate
+        self.tokens.reserve(tokens - estimate)
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_in_flight:
+            self.limit += 1
+            self._successes = 0
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["texts"] += texts
+            self._stats["tokens"] += tokens
+            self._stats["request_seconds"] += seconds
+            self._last_response = time.monotonic()
@@ -1,30 +1,181 @@
+from collections import deque
+from functools import lru_cache
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from utils.env_vars import CHUNKER_MODE, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, CHUNK_SOURCE_SIZES, EMBEDDING_BACKEND
+
+CHUNKER_MODES = ("auto", "tokens", "characters")
+# Backends embedding with the OpenAI models, whose tokenizer sizes the chunks in "auto" mode
+TOKENIZED_BACKENDS = ("openai", "openai_async")
+# Texts are cut at the first of these that yields pieces short enough: paragraphs, lines, sentences, words
+TOKEN_SEPARATORS = ("\n\n", "\n", ". ", " ")
 
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=500,
     chunk_overlap=100
 )
 
+def get_chunker_mode(mode: str = CHUNKER_MODE) -> str:
+    """
+    Resolve the chunker mode.
+
+    Args:
+        mode (str): "tokens", "characters", or "auto" for tokens with the OpenAI backends and characters otherwise.
+
+    Returns:
+        str: "tokens" or "characters".
+    """
+    if mode not in CHUNKER_MODES:
+        raise ValueError(f"Invalid CHUNKER_MODE {mode}, supported modes are: {', '.join(CHUNKER_MODES)}.")
+    if mode == "auto":
+        # The tokenizer of the OpenAI models is downloaded on first use, the offline backends keep characters
+        return "tokens" if EMBEDDING_BACKEND in TOKENIZED_BACKENDS else "characters"
+    return mode
+
+def parse_source_sizes(value: str = CHUNK_SOURCE_SIZES) -> dict:
+    """
+    Parse the per source chunk sizes.
+
+    Args:
+        value (str): Comma separated "source:size:overlap" entries, in tokens.
+
+    Returns:
+        dict: The (size, overlap) tuple of every configured source.
+    """
+    sizes = {}
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        try:
+            source, size, overlap = entry.rsplit(":", 2)
+            sizes[source] = (int(size), int(overlap))
+        except ValueError:
+            raise ValueError(f"Invalid CHUNK_SOURCE_SIZES entry {entry}, expected source:size:overlap.")
+    return sizes
+
+source_sizes = parse_source_sizes()
+
+@lru_cache(maxsize=None)
+def get_encoder():
+    """
+    Get the tokenizer of the embedding model, loaded once per process.
+
+    Returns:
+        tiktoken.Encoding: The tokenizer.
+    """
+    import tiktoken
+    from .openai_embeddings import EMBEDDING_MODEL
+    return tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+def count_tokens(text: str, encoder=None) -> int:
+    """
+    Count the embedding model tokens of a text.
+
+    Args:
+        text (str): The text.
+        encoder: The tokenizer, the embedding model's by default.
+
+    Returns:
+        int: The number of tokens.
+    """
+    return len((encoder or get_encoder()).encode(text, disallowed_special=()))
+
+def iter_pieces(text: str, size: int, encoder, separators: tuple = TOKEN_SEPARATORS):
+    """
+    Cut a text into pieces of at most `size` tokens at the coarsest separator possible.
+
+    Args:
+        text (str): The text.
+        size (int): The maximum number of tokens of a piece.
+        encoder: The tokenizer.
+        separators (tuple): The separators to try, coarsest first. Pieces still too long without separators are cut every `size` tokens.
+
+    Yields:
+        tuple: (piece, number of tokens) in text order, the pieces joined give back the text.
+    """
+    if not separators:
+        tokens = encoder.encode(text, disallowed_special=())
+        for start in range(0, len(tokens), size):
+            yield encoder.decode(tokens[start:start + size]), len(tokens[start:start + size])
+        return
+
+    separator, finer = separators[0], separators[1:]
+    start = 0
+    while start < len(text):
+        end = text.find(separator, start)
+        end = len(text) if end == -1 else end + len(separator)
+        piece = text[start:end]
+        count = count_tokens(piece, encoder)
+        if count <= size:
+            yield piece, count
+        else:
+            yield from iter_pieces(piece, size, encoder, finer)
+        start = end
+
+def iter_token_chunks(text: str, size: int, overlap: int, encoder=None):
+    """
+    Split a text into chunks of at most about `size` tokens, consecutive chunks sharing about `overlap` tokens.
+
+    Pieces are counted separately, so a chunk can be a few tokens off where a token spans two pieces.
+
+    Args:
+        text (str): The text.
+        size (int): The number of tokens of a chunk.
+        overlap (int): The number of tokens a chunk repeats from the end of the previous one.
+        encoder: The tokenizer, the embedding model's by default.
+
+    Yields:
+        str: The chunks, in text order.
+    """
+    encoder = encoder or get_encoder()
+    window, total = deque(), 0
+    for piece, count in iter_pieces(text, size, encoder):
+        if window and total + count > size:
+            yield "".join(piece for piece, _ in window)
+            # Keep the tail of the chunk as the start of the next one
+            while window and (total > overlap or total + count > size):
+                total -= window.popleft()[1]
+        window.append((piece, count))
+        total += count
+    if window:
+        yield "".join(piece for piece, _ in window)
+
 class ChunkerHandler:
     def __init__(self, user_id):
         self.user_id = user_id
 
+    def iter_documents(self, text: str, source: str = "user_input"):
+        """
+        Split a text into chunk documents, lazily.
+
+        In "tokens" mode chunks are sized in embedding model tokens, with the size and overlap of
+        their source from CHUNK_SOURCE_SIZES, or CHUNK_TOKENS and CHUNK_OVERLAP_TOKENS. In
+        "characters" mode the text is split by the 500 characters splitter.
+
+        Args:
+            text (str): The text to be split.
+            source (str): The source of the text, default is "user_input".
+
+        Yields:
+            Document: The chunks, in text order.
+        """
+        if get_chunker_mode() == "tokens":
+            size, overlap = source_sizes.get(source, (CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS))
+            texts = iter_token_chunks(text, size, overlap)
+        else:
+            texts = text_splitter.split_text(text)
+        for text in texts:
+            text = text.strip()
+            if text:
+                yield Document(page_content=text, metadata={"source": source, "user_id": self.user_id})
+
     def split_documents(self, text: str, source: str = "user_input") -> list:
         """
         Split documents into smaller chunks using a text splitter.
-        
+
         Args:
             text (str): The text to be split.
             source (str): The source of the text, default is "user_input".
-            
+
         Returns:
             list: A list of text chunks after splitting the documents.
         """
-
-        texts = text_splitter.split_text(text)
-        text_docs = []
-        for i, text in enumerate(texts):
-            text_docs.append(Document(page_content=text.strip(), metadata={"source": source, "user_id": self.user_id}))
-        
-        return text_docs
+        return list(self.iter_documents(text, source))
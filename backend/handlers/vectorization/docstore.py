@@ -0,0 +1,319 @@
+import json
+import os
+import sqlite3
+from langchain_core.documents import Document
+from .lexical_index import term_frequencies
+
+# SQLite limits the number of bound parameters per statement
+LOOKUP_BATCH_SIZE = 500
+# Upper bound of the memory map SQLite may use for a snapshot, it never maps more than the file size
+MMAP_SIZE = 1 << 30
+# Metadata fields stored in their own indexed columns, so that searches and listings can be filtered on them
+FILTER_FIELDS = ("user_id", "source")
+
+class ShardDocstore:
+    """
+    Texts and metadata of a shard's documents, addressed by internal FAISS position.
+
+    The documents of the base snapshot live in a read-only SQLite file that is memory-mapped, so
+    opening it is instant, only the rows a search or listing returns are read, and every worker on
+    the host shares the same page cache. The filterable metadata fields and `created_at` are stored
+    in indexed columns next to the JSON metadata, so ID lookups, filters and listings are served by
+    the file's indexes instead of scanning every document. The file also holds the inverted index
+    (term -> positions and frequencies) used for lexical search. Documents added through the WAL
+    since the snapshot are kept in an in-memory overlay until the next compaction writes a new file,
+    and so are metadata updates of snapshot documents.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.overlay = {}
+        self.metadata_overrides = {}
+        self.base_count = 0
+        self._conn = None
+        self._filter_cache = {}
+        self._total_length = None
+        self.has_postings = False
+        if path is not None:
+            # Snapshot files are replaced by renaming, never modified, so SQLite can skip locking entirely.
+            # Access is serialized by the shard's lock, which lets the connection be used from any thread.
+            self._conn = sqlite3.connect(f"file:{path}?immutable=1", uri=True, check_same_thread=False)
+            self._conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            # Positions are numbered from 0 without gaps, the largest one is found in the primary key
+            self.base_count = self._conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM documents").fetchone()[0]
+            self.has_postings = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'postings'").fetchone() is not None
+
+    def add(self, position: int, doc_id: str, page_content: str, metadata: dict) -> None:
+        """
+        Add a document written since the base snapshot.
+
+        Args:
+            position (int): The internal FAISS position of the document.
+            doc_id (str): The ID of the document.
+            page_content (str): The text of the document.
+            metadata (dict): The metadata of the document.
+        """
+        self.overlay[position] = (doc_id, page_content, metadata)
+
+    def update_metadata(self, position: int, metadata: dict) -> None:
+        """
+        Replace the metadata of a document, until the next compaction writes it to a new snapshot.
+
+        The filterable fields must keep their values, the snapshot's column indexes are not updated.
+
+        Args:
+            position (int): The internal FAISS position of the document.
+            metadata (dict): The new metadata of the document.
+        """
+        if position in self.overlay:
+            doc_id, page_content, _ = self.overlay[position]
+            self.overlay[position] = (doc_id, page_content, metadata)
+        else:
+            self.metadata_overrides[position] = metadata
+
+    def copy(self) -> "ShardDocstore":
+        """
+        Get a frozen view of the documents, unaffected by later writes to this docstore.
+
+        The copy opens its own connection to the snapshot file, so it stays usable after this
+        docstore is closed.
+
+        Returns:
+            ShardDocstore: The copy, to be closed by the caller.
+        """
+        docstore = ShardDocstore(self.path)
+        # Overlay entries are replaced rather than mutated, shallow copies are enough
+        docstore.overlay = dict(self.overlay)
+        docstore.metadata_overrides = dict(self.metadata_overrides)
+        return docstore
+
+    def get_many(self, positions) -> dict:
+        """
+        Fetch the documents at the given positions.
+
+        Args:
+            positions: The internal positions to fetch.
+
+        Returns:
+            dict: Position -> Document for every position that exists. The documents are fresh
+                  copies that callers may modify.
+        """
+        found = {}
+        missing = []
+        for position in positions:
+            entry = self.overlay.get(position)
+            if entry is None:
+                missing.append(position)
+            else:
+                doc_id, page_content, metadata = entry
+                found[position] = Document(id=doc_id, page_content=page_content, metadata=dict(metadata))
+
+        for batch in self._batches(missing):
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT position, doc_id, page_content, metadata FROM documents WHERE position IN ({placeholders})",
+                batch
+            )
+            for position, doc_id, page_content, metadata in rows:
+                found[position] = Document(id=doc_id, page_content=page_content, metadata=self._metadata(position, metadata))
+        return found
+
+    def find_positions(self, doc_ids: list) -> dict:
+        """
+        Look up the positions of documents stored in the base snapshot.
+
+        Args:
+            doc_ids (list): The IDs of the documents.
+
+        Returns:
+            dict: Document ID -> position for every ID found in the snapshot file.
+        """
+        found = {}
+        for batch in self._batches(doc_ids):
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(f"SELECT doc_id, position FROM documents WHERE doc_id IN ({placeholders})", batch)
+            found.update(rows)
+        return found
+
+    def filter_positions(self, field: str, value) -> set:
+        """
+        Get the positions of the base snapshot's documents whose metadata field has a value.
+
+        Args:
+            field (str): One of FILTER_FIELDS.
+            value: The value to match.
+
+        Returns:
+            set: The matching positions.
+        """
+        if self._conn is None:
+            return set()
+        # The snapshot file never changes, so the positions of a value can be cached until it is replaced
+        key = (field, value)
+        if key not in self._filter_cache:
+            rows = self._conn.execute(f"SELECT position FROM documents WHERE {field} = ?", (value,))
+            self._filter_cache[key] = frozenset(position for (position,) in rows)
+        return self._filter_cache[key]
+
+    def get_postings(self, terms: list) -> list:
+        """
+        Get the postings of the given terms in the base snapshot.
+
+        Args:
+            terms (list): The query terms.
+
+        Returns:
+            list: (term, position, frequency, document length) tuples.
+        """
+        if not self.has_postings:
+            return []
+        postings = []
+        for batch in self._batches(terms):
+            placeholders = ",".join("?" * len(batch))
+            postings.extend(self._conn.execute(
+                f"SELECT p.term, p.position, p.frequency, d.length FROM postings p JOIN documents d ON d.position = p.position "
+                f"WHERE p.term IN ({placeholders})",
+                batch
+            ))
+        return postings
+
+    @property
+    def total_length(self) -> int:
+        """
+        The total number of terms in the base snapshot's documents.
+        """
+        if self._total_length is None:
+            self._total_length = self._conn.execute("SELECT COALESCE(SUM(length), 0) FROM documents").fetchone()[0] if self.has_postings else 0
+        return self._total_length
+
+    def iter_documents(self, filters: dict = None, before: int = None, newest_first: bool = False):
+        """
+        Iterate over the documents of the base snapshot and the overlay in position order.
+
+        Rows are read lazily, so stopping early only costs the rows that were consumed.
+
+        Args:
+            filters (dict): Optional values the documents must match, keyed by a field in FILTER_FIELDS.
+            before (int): Only yield documents at positions below this one.
+            newest_first (bool): Whether to iterate from the highest position down.
+
+        Yields:
+            tuple: The position and a fresh copy of every matching document.
+        """
+        filters = filters or {}
+        overlay = (self._iter_overlay(filters, before, newest_first),)
+        base = (self._iter_base(filters, before, newest_first),)
+        for source in (overlay + base) if newest_first else (base + overlay):
+            yield from source
+
+    def _iter_base(self, filters: dict, before: int, newest_first: bool):
+        if self._conn is None:
+            return
+        conditions = [f"{field} = ?" for field in filters]
+        params = list(filters.values())
+        if before is not None:
+            conditions.append("position < ?")
+            params.append(before)
+        rows = self._conn.execute(
+            f"SELECT position, doc_id, page_content, metadata FROM documents WHERE {' AND '.join(conditions) or '1'} "
+            f"ORDER BY position {'DESC' if newest_first else 'ASC'}",
+            params
+        )
+        for position, doc_id, page_content, metadata in rows:
+            yield position, Document(id=doc_id, page_content=page_content, metadata=self._metadata(position, metadata))
+
+    def _iter_overlay(self, filters: dict, before: int, newest_first: bool):
+        for position in sorted(self.overlay, reverse=newest_first):
+            if before is not None and position >= before:
+                continue
+            doc_id, page_content, metadata = self.overlay[position]
+            if all(metadata.get(field) == value for field, value in filters.items()):
+                yield position, Document(id=doc_id, page_content=page_content, metadata=dict(metadata))
+
+    def _metadata(self, position: int, metadata: str) -> dict:
+        override = self.metadata_overrides.get(position)
+        return dict(override) if override is not None else json.loads(metadata)
+
+    def close(self) -> None:
+        """
+        Close the snapshot file.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _batches(self, values: list):
+        if self._conn is None:
+            return
+        for start in range(0, len(values), LOOKUP_BATCH_SIZE):
+            yield values[start:start + LOOKUP_BATCH_SIZE]
+
+    @staticmethod
+    def write(path: str, rows) -> None:
+        """
+        Write a snapshot file.
+
+        The file is built next to the target and renamed over it, so workers still reading the
+        previous snapshot keep a consistent view of it.
+
+        Args:
+            path (str): The path of the snapshot file.
+            rows: An iterable of (position, doc_id, page_content, metadata) tuples, in position order.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        filter_columns = ", ".join(FILTER_FIELDS)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            # The filter columns have no declared type so values keep the type they have in the metadata
+            conn.execute(f"""
+                CREATE TABLE documents (
+                    position INTEGER PRIMARY KEY,
+                    doc_id TEXT NOT NULL,
+                    page_content TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    {filter_columns},
+                    created_at TEXT,
+                    length INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE postings (
+                    term TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    frequency INTEGER NOT NULL,
+                    PRIMARY KEY (term, position)
+                ) WITHOUT ROWID
+            """)
+
+            insert_document = f"INSERT INTO documents VALUES (?, ?, ?, ?, {', '.join('?' * len(FILTER_FIELDS))}, ?, ?)"
+            documents, postings = [], []
+            for position, doc_id, page_content, metadata in rows:
+                frequencies, length = term_frequencies(page_content)
+                documents.append((
+                    position, doc_id, page_content, json.dumps(metadata),
+                    *(metadata.get(field) for field in FILTER_FIELDS), metadata.get("created_at"), length
+                ))
+                postings.extend((term, position, frequency) for term, frequency in frequencies.items())
+                if len(documents) >= LOOKUP_BATCH_SIZE:
+                    conn.executemany(insert_document, documents)
+                    conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+                    documents, postings = [], []
+            conn.executemany(insert_document, documents)
+            conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+            # Indexes are created after the bulk insert, which is much faster than maintaining them row by row
+            conn.execute("CREATE UNIQUE INDEX idx_documents_doc_id ON documents (doc_id)")
+            for field in FILTER_FIELDS:
+                conn.execute(f"CREATE INDEX idx_documents_{field} ON documents ({field})")
+            conn.execute("CREATE INDEX idx_documents_created_at ON documents (created_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
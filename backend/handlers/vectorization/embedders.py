@@ -0,0 +1,154 @@
+import zlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from .embedding_cache import CachedEmbeddings
+from .lexical_index import tokenize
+from utils.env_vars import (
+    EMBEDDING_BACKEND, EMBEDDING_DIMENSIONS, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_BASE_URL,
+    EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_TOKENS, EMBEDDING_MAX_IN_FLIGHT, EMBEDDING_RPM, EMBEDDING_TPM,
+)
+
+# Dimension of the hashing embedder when EMBEDDING_DIMENSIONS is not set, the same as text-embedding-3-small
+HASHING_DEFAULT_DIMENSIONS = 1536
+# Length of the character n-grams, they make texts sharing word stems or with typos land close together
+HASHING_CHAR_NGRAM = 3
+# Character n-grams are more numerous than words, they are down-weighted so that whole words dominate
+HASHING_CHAR_WEIGHT = 0.5
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic local embeddings built with the hashing trick.
+
+    Word unigrams, word bigrams and character trigrams of a text are hashed into a fixed number
+    of signed buckets and the resulting vector is normalized to unit length. The same text always
+    gets the same vector, in every process and on every host, without any network access, and
+    texts sharing words end up close together. The vectors only capture surface overlap, not
+    meaning, so this backend is meant for tests, load tests and benchmarks of the vector pipeline.
+    """
+
+    def __init__(self, dimensions: int = HASHING_DEFAULT_DIMENSIONS):
+        if dimensions <= 0:
+            raise ValueError(f"The hashing embedder needs a positive dimension, got {dimensions}.")
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: list) -> list:
+        """
+        Embed a list of texts.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            list: The embedding of every text, in order.
+        """
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        """
+        Embed a search query, the same way as a document.
+
+        Args:
+            text (str): The query.
+
+        Returns:
+            list: The embedding of the query.
+        """
+        return self._embed(text).tolist()
+
+    def _embed(self, text: str) -> np.ndarray:
+        words = tokenize(text)
+        features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+        char_ngrams = [
+            padded[start:start + HASHING_CHAR_NGRAM]
+            for padded in (f"<{word}>" for word in words)
+            for start in range(len(padded) - HASHING_CHAR_NGRAM + 1)
+        ]
+
+        grams = features + char_ngrams
+        if not grams:
+            return np.zeros(self.dimensions, dtype=np.float32)
+        # crc32 is stable across processes, unlike hash(), and fast enough for millions of texts
+        hashes = np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.int64, count=len(grams))
+        weights = np.where(np.arange(len(grams)) < len(features), 1.0, HASHING_CHAR_WEIGHT)
+        signs = np.where(hashes & (1 << 31), -weights, weights)
+        vector = np.bincount(hashes % self.dimensions, weights=signs, minlength=self.dimensions).astype(np.float32)
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+def with_cache(embeddings: Embeddings, model: str, dimensions: int) -> Embeddings:
+    if not EMBEDDING_CACHE_PATH:
+        return embeddings
+    # Vectors of different dimensions must not be served for each other from the cache
+    model = f"{model}:{dimensions}" if dimensions else model
+    return CachedEmbeddings(embeddings, model, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
+
+def create_openai_embedder(dimensions: int) -> Embeddings:
+    # Imported here so that the other backends work without OpenAI credentials
+    from .openai_embeddings import EMBEDDING_MODEL, get_openai_embeddings
+    return with_cache(get_openai_embeddings(dimensions), EMBEDDING_MODEL, dimensions)
+
+def create_openai_async_embedder(dimensions: int) -> Embeddings:
+    from .openai_embeddings import EMBEDDING_MODEL
+    from .async_embeddings import AsyncEmbeddings
+    embeddings = AsyncEmbeddings(
+        EMBEDDING_MODEL,
+        dimensions,
+        base_url=EMBEDDING_BASE_URL,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        batch_tokens=EMBEDDING_BATCH_TOKENS,
+        max_in_flight=EMBEDDING_MAX_IN_FLIGHT,
+        rpm=EMBEDDING_RPM,
+        tpm=EMBEDDING_TPM,
+    )
+    # Same model, same vectors: the cache is shared with the synchronous backend
+    return with_cache(embeddings, EMBEDDING_MODEL, dimensions)
+
+def create_hashing_embedder(dimensions: int) -> Embeddings:
+    # Hashing a text is cheaper than looking it up in the cache, so it is never cached
+    return HashingEmbeddings(dimensions or HASHING_DEFAULT_DIMENSIONS)
+
+EMBEDDING_BACKENDS = {
+    "openai": create_openai_embedder,
+    "openai_async": create_openai_async_embedder,
+    "hashing": create_hashing_embedder,
+}
+
+def get_embedder(backend: str = EMBEDDING_BACKEND, dimensions: int = EMBEDDING_DIMENSIONS) -> Embeddings:
+    """
+    Create the embedder of a backend.
+
+    Args:
+        backend (str): One of EMBEDDING_BACKENDS.
+        dimensions (int): The dimension of the embeddings, 0 uses the backend's default.
+
+    Returns:
+        Embeddings: The embedder.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Embedding backend {backend} is not supported. Supported backends are: {', '.join(EMBEDDING_BACKENDS)}.")
+    return EMBEDDING_BACKENDS[backend](dimensions)
+
+embedder = get_embedder()
+
+def unwrap_embeddings(embeddings: Embeddings) -> Embeddings:
+    """
+    Get the embedder behind the embedding cache, if any.
+
+    Args:
+        embeddings (Embeddings): An embedder, possibly cached.
+
+    Returns:
+        Embeddings: The embedder computing the embeddings.
+    """
+    return embeddings.embeddings if isinstance(embeddings, CachedEmbeddings) else embeddings
+
+def get_embedding_stats() -> dict | None:
+    """
+    Get the request counters and throughput of the embedder, for the backends that keep them.
+
+    Returns:
+        dict | None: The stats of the embedder, None if its backend does not keep any.
+    """
+    embeddings = unwrap_embeddings(embedder)
+    return embeddings.stats() if hasattr(embeddings, "stats") else None
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# SQLite limits the number of bound parameters per statement
+LOOKUP_BATCH_SIZE = 500
+# Eviction needs a COUNT(*) scan, so it is only checked every this many inserts
+EVICTION_CHECK_INTERVAL = 256
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves previously embedded texts from a persistent SQLite cache.
+
+    Entries are content addressed by (model, sha256(text)), so re-storing a fact, re-adding mostly
+    unchanged content or rebuilding an index only pays for the texts that were never embedded.
+    The cache is bounded to `max_entries`, evicting the least recently used entries first.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, path: str, max_entries: int = 200000):
+        self.embeddings = embeddings
+        self.model = model
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._inserts = 0
+        self._inserts_lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+
+    def embed_documents(self, texts: list) -> list:
+        """
+        Embed a list of texts, calling the wrapped embeddings only for cache misses.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            list: The embedding of every text, in order.
+        """
+        if not texts:
+            return []
+
+        hashes = [self.hash_text(text) for text in texts]
+        vectors = self._lookup(hashes)
+
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in vectors and text_hash not in missing:
+                missing[text_hash] = text
+
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_entries = dict(zip(missing.keys(), new_vectors))
+            self._store(new_entries)
+            vectors.update(new_entries)
+
+        return [list(vectors[text_hash]) for text_hash in hashes]
+
+    def embed_query(self, text: str) -> list:
+        """
+        Embed a single query text, calling the wrapped embeddings only on a cache miss.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            list: The embedding of the text.
+        """
+        text_hash = self.hash_text(text)
+        cached = self._lookup([text_hash])
+        if text_hash in cached:
+            return list(cached[text_hash])
+
+        vector = self.embeddings.embed_query(text)
+        self._store({text_hash: vector})
+        return vector
+
+    def hash_text(self, text: str) -> str:
+        """
+        Get the content address of a text.
+
+        Args:
+            text (str): The text to hash.
+
+        Returns:
+            str: The hex sha256 digest of the text.
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared across threads, keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _lookup(self, hashes: list) -> dict:
+        conn = self._connection()
+        unique_hashes = list(dict.fromkeys(hashes))
+        found = {}
+        for start in range(0, len(unique_hashes), LOOKUP_BATCH_SIZE):
+            batch = unique_hashes[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [self.model, *batch]
+            ).fetchall()
+            for text_hash, vector in rows:
+                found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+
+        if found:
+            now = time.time()
+            with conn:
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, self.model, text_hash) for text_hash in found]
+                )
+        return found
+
+    def _store(self, entries: dict) -> None:
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (self.model, text_hash, len(vector), np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for text_hash, vector in entries.items()
+                ]
+            )
+
+        with self._inserts_lock:
+            self._inserts += len(entries)
+            if self._inserts < EVICTION_CHECK_INTERVAL:
+                return
+            self._inserts = 0
+        self._evict()
+
+    def _evict(self) -> None:
+        conn = self._connection()
+        with conn:
+            count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
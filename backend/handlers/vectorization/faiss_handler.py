@@ -1,102 +1,339 @@
-from langchain_community.vectorstores import FAISS
-from .openai_embeddings import embedder
-from utils.env_vars import FAISS_INDEX_DIR
+import base64
+import json
+import os
+from datetime import datetime, timezone
+from .embedders import embedder
+from .index_manager import index_manager
+from .query_cache import embed_query, embed_queries, normalize_query, search_results
+from .lexical_index import reciprocal_rank_fusion
+from .write_batcher import WriteBatcher
+from utils.env_vars import FAISS_INDEX_DIR, MEMORY_SEARCH_MODE, MEMORY_DEDUP_THRESHOLD, MEMORY_DEDUP_MODE, MEMORY_WRITE_BATCH_WINDOW_MS, MEMORY_WRITE_BATCH_SIZE
+
+SHARDS_DIR = os.path.join(FAISS_INDEX_DIR, "users")
+# Search pages are served from a cached ranking that is extended by at least this factor when a page runs past it
+SEARCH_PAGE_GROWTH = 2
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+DEDUP_MODES = ("merge", "skip")
+# Number of candidates each ranking contributes to a hybrid search, per requested result
+HYBRID_CANDIDATE_FACTOR = 4
+
+def get_shard_dir(user_id) -> str:
+    """
+    Get the directory holding a user's FAISS index shard.
+
+    Args:
+        user_id: The ID of the user owning the shard.
+
+    Returns:
+        str: The path of the shard directory.
+    """
+    return os.path.join(SHARDS_DIR, str(user_id))
+
+def encode_cursor(data: dict) -> str:
+    """
+    Encode a pagination cursor as an opaque, URL safe string.
+
+    Args:
+        data (dict): The state needed to resume after the current page.
+
+    Returns:
+        str: The cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Decode a cursor returned by `encode_cursor`.
+
+    Args:
+        cursor (str): The cursor.
+
+    Returns:
+        dict: The state stored in the cursor.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor.")
+    if not isinstance(data, dict):
+        raise ValueError("Invalid cursor.")
+    return data
+
+def with_created_at(documents) -> list:
+    """
+    Get the metadata of documents, stamped with the current time as `created_at` unless they already carry one.
+
+    Args:
+        documents (list): The documents being stored.
+
+    Returns:
+        list: A metadata dict per document.
+    """
+    created_at = datetime.now(timezone.utc).isoformat()
+    return [{"created_at": created_at, **doc.metadata} for doc in documents]
+
+def write_documents(index_dir: str, texts: list, vectors, metadatas: list, replaced_ids: list = None) -> list:
+    """
+    Append embedded documents to a shard with a single write, skipping near-duplicates of stored
+    documents (cosine similarity of at least MEMORY_DEDUP_THRESHOLD). Their metadata is merged into
+    the stored document when MEMORY_DEDUP_MODE is "merge".
+
+    Args:
+        index_dir (str): The directory of the shard.
+        texts (list): The document texts.
+        vectors: The embeddings of the texts.
+        metadatas (list): The metadata of each document.
+        replaced_ids (list): The IDs of documents deleted in the same write, e.g. the previous version of an edited memory.
+
+    Returns:
+        list: A (document ID, duplicate) tuple per document, duplicates carry the ID of the stored document they repeat.
+    """
+    shard = index_manager.get_shard(index_dir)
+    if MEMORY_DEDUP_THRESHOLD <= 0:
+        return [(doc_id, False) for doc_id in shard.replace(replaced_ids or [], texts, vectors, metadatas)]
+
+    results = shard.add_unique(texts, vectors, metadatas, MEMORY_DEDUP_THRESHOLD, merge=MEMORY_DEDUP_MODE == "merge", replaced_ids=replaced_ids)
+    skipped = sum(duplicate for _, duplicate in results)
+    if skipped:
+        print(f"Skipped {skipped} of {len(texts)} near-duplicate memories in {index_dir}")
+    return results
+
+# Concurrent memory writes of this worker share embedding calls and WAL appends
+write_batcher = WriteBatcher(embedder, write_documents, MEMORY_WRITE_BATCH_WINDOW_MS / 1000, MEMORY_WRITE_BATCH_SIZE)
 
 class FaissHandler:
     def __init__(self, user_id):
         self.user_id = user_id
-    
-    def create_faiss_index(self, documents) -> FAISS:
+        self.index_dir = get_shard_dir(user_id)
+
+    def create_faiss_index(self, documents) -> dict:
+        """
+        Embed the provided documents using OpenAI embeddings and append them to the user's index.
+
+        Writes made concurrently by other requests are coalesced with this one into a single
+        embeddings call and WAL append, see `write_documents` for how near-duplicates are handled.
+
+        Args:
+            documents (list): A list of documents to be indexed.
+
+        Returns:
+            dict: The IDs of the indexed documents, and for every skipped near-duplicate the ID of the stored document it repeats.
+        """
+        results = self.index_documents(documents)
+        return {
+            "ids": [doc_id for doc_id, duplicate in results if not duplicate],
+            "duplicate_ids": [doc_id for doc_id, duplicate in results if duplicate],
+        }
+
+    def index_documents(self, documents) -> list:
         """
-        Create a FAISS index from the provided documents using OpenAI embeddings.
-        
+        Embed and append documents to the user's index like `create_faiss_index`, reporting the outcome of each one.
+
         Args:
             documents (list): A list of documents to be indexed.
-            
+
         Returns:
-            FAISS: A FAISS index containing the embedded documents.
-        """
-        import os
-        index_path = os.path.join(FAISS_INDEX_DIR, "index.faiss")
-        
-        if os.path.exists(index_path):
-            existing_index = FAISS.load_local(FAISS_INDEX_DIR, embedder, allow_dangerous_deserialization=True)
-            new_index = FAISS.from_documents(documents, embedder)
-            existing_index.merge_from(new_index)
-            existing_index.save_local(FAISS_INDEX_DIR)
-            return existing_index
-        else:
-            faiss_index = FAISS.from_documents(documents, embedder)
-            faiss_index.save_local(FAISS_INDEX_DIR)
-            return faiss_index
-
-    def search_faiss_index(self, query: str, source: str, k: int = 5) -> list:
+            list: A (document ID, duplicate) tuple per document, in order. Skipped near-duplicates carry the ID of the stored document they repeat.
+        """
+        if not documents:
+            return []
+        if MEMORY_DEDUP_MODE not in DEDUP_MODES:
+            raise ValueError(f"Invalid MEMORY_DEDUP_MODE {MEMORY_DEDUP_MODE}, supported modes are: {', '.join(DEDUP_MODES)}.")
+
+        texts = [doc.page_content for doc in documents]
+        return write_batcher.submit(self.index_dir, texts, with_created_at(documents)).result()
+
+    def search_faiss_index(self, query: str, source: str, k: int = 5, mode: str = MEMORY_SEARCH_MODE) -> list:
         """
         Search the FAISS index for the most relevant documents to the query.
-        
+
         Args:
             query (str): The search query.
+            source (str): Optional source the documents must come from.
             k (int): The number of top results to return.
-            
+            mode (str): "vector" for embedding similarity, "lexical" for BM25 term matching, or "hybrid"
+                        to fuse both rankings with reciprocal rank fusion.
+
         Returns:
             list: A list of the top k documents matching the query.
         """
-        faiss_index = FAISS.load_local(FAISS_INDEX_DIR, embedder, allow_dangerous_deserialization=True)
-        
-        search_filter = {"user_id": self.user_id}
-        if source:
-            search_filter["source"] = source
-            
-        results = faiss_index.similarity_search(
-            query,
-            k=k,
-            filter=search_filter
-        )
+        shard = index_manager.get_shard(self.index_dir)
+        cache_key = (self.index_dir, shard.version, normalize_query(query), k, source, mode)
+        ids = search_results.get(cache_key)
+        if ids is None:
+            ids = self._rank(shard, query, k, source, mode)
+            search_results.set(cache_key, ids)
+        return shard.get_documents(ids)
+
+    def search_faiss_index_batch(self, queries: list, source: str, k: int = 5) -> list:
+        """
+        Search the FAISS index for several queries at once and merge the results.
+
+        All queries are embedded in a single batch and searched with one FAISS call over the query matrix.
 
-        return results
+        Args:
+            queries (list): The search queries.
+            source (str): Optional source the documents must come from.
+            k (int): The number of top results to fetch per query.
 
-    def get_all_documents(self) -> list:
+        Returns:
+            list: The deduplicated documents, closest first. Each document's metadata holds the
+                  L2 distance to every query that matched it under "scores" (lower is closer).
+        """
+        queries = list(dict.fromkeys(normalize_query(query) for query in queries if query.strip()))
+        if not queries:
+            return []
+
+        embeddings = embed_queries(queries)
+        results = index_manager.get_shard(self.index_dir).search_with_scores(embeddings, k, {"source": source} if source else None)
+
+        merged = {}
+        best_distances = {}
+        for query, query_results in zip(queries, results):
+            for doc, distance in query_results:
+                if doc.id not in merged:
+                    doc.metadata["scores"] = {}
+                    merged[doc.id] = doc
+                    best_distances[doc.id] = distance
+                merged[doc.id].metadata["scores"][query] = distance
+                best_distances[doc.id] = min(best_distances[doc.id], distance)
+
+        return sorted(merged.values(), key=lambda doc: best_distances[doc.id])
+
+    def get_all_documents(self, source: str = None) -> list:
         """
         Retrieve all documents for the user from the FAISS index.
-        
+
+        Args:
+            source (str): Optional source the documents must come from.
+
+        Returns:
+            list: A list of all documents belonging to the user, oldest first.
+        """
+        return index_manager.get_shard(self.index_dir).get_all_documents({"source": source} if source else None)
+
+    def list_documents_page(self, limit: int, cursor: str = None, offset: int = 0) -> dict:
+        """
+        List one page of the user's documents, newest first.
+
+        Args:
+            limit (int): The maximum number of documents to return.
+            cursor (str): The cursor returned with the previous page, None for the first page.
+            offset (int): The number of documents to skip, for clients paginating by page number.
+
         Returns:
-            list: A list of all documents belonging to the user.
-        """
-        # load_local parameter allow_dangerous_deserialization might be required for recent langchain versions, 
-        # but to match existing codebase usage we continue without it if not specified earlier.
-        # Actually it is specified now because it crashes otherwise.
-        faiss_index = FAISS.load_local(FAISS_INDEX_DIR, embedder, allow_dangerous_deserialization=True)
-        
-        user_docs = []
-        for doc_id, doc in faiss_index.docstore._dict.items():
-            if doc.metadata.get("user_id") == self.user_id:
-                # Inject the hidden FAISS UUID into the metadata dictionary so it can be passed to the frontend
-                doc.metadata["id"] = doc_id
-                user_docs.append(doc)
-                
-        return user_docs
+            dict: The documents, the cursor of the next page (None on the last page) and the total number of documents.
+        """
+        shard = index_manager.get_shard(self.index_dir)
+        documents, next_cursor = shard.list_documents(limit, decode_cursor(cursor) if cursor else None, offset)
+        return {
+            "documents": documents,
+            "next_cursor": encode_cursor(next_cursor) if next_cursor else None,
+            "total": shard.count(),
+        }
+
+    def search_faiss_index_page(self, query: str, source: str, limit: int, cursor: str = None, offset: int = 0,
+                                mode: str = MEMORY_SEARCH_MODE) -> dict:
+        """
+        Get one page of the documents most relevant to a query.
+
+        The ranking of a query is cached per shard version and only extended when a page runs past
+        it, so fetching the next page does not repeat the search in the common case.
+
+        Args:
+            query (str): The search query.
+            source (str): Optional source the documents must come from.
+            limit (int): The maximum number of documents to return.
+            cursor (str): The cursor returned with the previous page, None for the first page.
+            offset (int): The number of documents to skip, for clients paginating by page number.
+            mode (str): One of SEARCH_MODES, see `search_faiss_index`.
+
+        Returns:
+            dict: The documents, the cursor of the next page (None on the last page) and the total number of
+                  the user's memories from `source`. Vector search ranks all of them, lexical and hybrid
+                  searches do not rank the memories sharing no term with the query, so pages can end
+                  before `total` is reached.
+        """
+        if cursor:
+            offset = decode_cursor(cursor).get("offset", 0)
+
+        shard = index_manager.get_shard(self.index_dir)
+        filters = {"source": source} if source else None
+        # One result past the page tells whether there is a next one
+        needed = offset + limit + 1
+        cache_key = ("ranking", self.index_dir, shard.version, normalize_query(query), source, mode)
+        ranking = search_results.get(cache_key)
+        # A ranking shorter than the k it was searched with already holds every matching document
+        if ranking is None or (len(ranking[1]) < needed and len(ranking[1]) == ranking[0]):
+            k = max(needed, SEARCH_PAGE_GROWTH * ranking[0]) if ranking else needed
+            ranking = (k, self._rank(shard, query, k, source, mode))
+            search_results.set(cache_key, ranking)
+
+        ids = ranking[1]
+        return {
+            "documents": shard.get_documents(ids[offset:offset + limit]),
+            "next_cursor": encode_cursor({"offset": offset + limit}) if len(ids) > offset + limit else None,
+            "total": shard.count(filters),
+        }
+
+    def _rank(self, shard, query: str, k: int, source: str, mode: str) -> list:
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Search mode {mode} is not supported. Supported modes are: {', '.join(SEARCH_MODES)}.")
+
+        # Each user has their own shard, so only the source needs to be filtered on
+        filters = {"source": source} if source else None
+        if mode == "vector":
+            return [doc.id for doc in shard.search(embed_query(query), k, filters)]
+        if mode == "lexical":
+            return [doc.id for doc, _ in shard.lexical_search(query, k, filters)]
+
+        candidates = k * HYBRID_CANDIDATE_FACTOR
+        vector_ids = [doc.id for doc in shard.search(embed_query(query), candidates, filters)]
+        lexical_ids = [doc.id for doc, _ in shard.lexical_search(query, candidates, filters)]
+        return reciprocal_rank_fusion([vector_ids, lexical_ids], k)
 
     def delete_document(self, doc_id: str) -> bool:
         """
         Deletes a specific document from the FAISS index by its internal UUID.
-        
+
         Args:
             doc_id (str): The internal FAISS UUID of the document.
-            
+
         Returns:
             bool: True if deletion was successful, False otherwise.
         """
-        import os
-        index_path = os.path.join(FAISS_INDEX_DIR, "index.faiss")
-        
-        if not os.path.exists(index_path):
-            return False
-            
+        return len(self.delete_documents([doc_id])) == 1
+
+    def delete_documents(self, doc_ids: list) -> list:
+        """
+        Deletes several documents from the FAISS index with a single write.
+
+        Args:
+            doc_ids (list): The internal FAISS UUIDs of the documents.
+
+        Returns:
+            list: The IDs that belonged to the user and were deleted.
+        """
         try:
-            faiss_index = FAISS.load_local(FAISS_INDEX_DIR, embedder, allow_dangerous_deserialization=True)
-            faiss_index.delete([doc_id])
-            faiss_index.save_local(FAISS_INDEX_DIR)
-            return True
+            return index_manager.get_shard(self.index_dir).delete(doc_ids)
         except Exception as e:
-            print(f"Error deleting document {doc_id} from FAISS index: {e}")
-            return False
+            print(f"Error deleting documents {doc_ids} from FAISS index: {e}")
+            return []
+
+    def replace_document(self, doc_id: str, documents) -> list:
+        """
+        Replace a document with new ones, deleting the old vector and adding the new ones in a single write.
+
+        The new documents go through the write batcher like `create_faiss_index`, so near-duplicates
+        of other stored documents are skipped; the replaced document itself never counts as one.
+
+        Args:
+            doc_id (str): The internal FAISS UUID of the document being replaced.
+            documents (list): The documents replacing it.
+
+        Returns:
+            list: The IDs of the new documents that were stored.
+        """
+        texts = [doc.page_content for doc in documents]
+        results = write_batcher.submit(self.index_dir, texts, with_created_at(documents), [doc_id]).result()
+        return [new_id for new_id, duplicate in results if not duplicate]
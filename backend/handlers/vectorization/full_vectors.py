@@ -0,0 +1,110 @@
+import os
+import numpy as np
+from .index_factory import reconstruct_vectors
+
+class FullVectorStore:
+    """
+    Full precision copies of a shard's vectors, addressed by internal FAISS position.
+
+    The vectors of the base snapshot are memory-mapped from disk and only paged in when read,
+    vectors added through the WAL since then are kept in memory. Compressed indexes use the store
+    to re-rank their candidates exactly, and rebuilds use it instead of decoding lossy codes.
+    """
+
+    def __init__(self, base: np.ndarray = None, fallback_index=None):
+        self.base = base
+        # Snapshots of uncompressed full dimension indexes, or written before full vectors were stored, are read back from the index
+        self.fallback_index = fallback_index
+        self.base_count = 0
+        self.dim = 0
+        if base is not None:
+            self.base_count, self.dim = base.shape
+        elif fallback_index is not None:
+            self.base_count, self.dim = fallback_index.ntotal, fallback_index.d
+        self._appended = []
+        self._appended_count = 0
+        self._tail = None
+
+    @classmethod
+    def load(cls, path: str, fallback_index=None) -> "FullVectorStore":
+        """
+        Open the vectors of a snapshot without reading them into memory.
+
+        Args:
+            path (str): The path of the .npy file written by `save`.
+            fallback_index: The snapshot's FAISS index, used when the file does not exist.
+
+        Returns:
+            FullVectorStore: The store.
+        """
+        if os.path.exists(path):
+            return cls(np.load(path, mmap_mode="r"))
+        return cls(fallback_index=fallback_index)
+
+    def __len__(self) -> int:
+        return self.base_count + self._appended_count
+
+    def append(self, vectors) -> None:
+        """
+        Add vectors at the next positions.
+
+        Args:
+            vectors: A (n, dim) array of vectors.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.dim = vectors.shape[1]
+        self._appended.append(vectors)
+        self._appended_count += len(vectors)
+        self._tail = None
+
+    def get(self, positions) -> np.ndarray:
+        """
+        Read the vectors at the given positions.
+
+        Args:
+            positions: The internal positions to read.
+
+        Returns:
+            np.ndarray: A (len(positions), dim) float32 array.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+
+        in_base = positions < self.base_count
+        if in_base.all():
+            return self._get_base(positions)
+
+        tail = self._get_tail()
+        if not in_base.any():
+            return tail[positions - self.base_count]
+
+        result = np.empty((len(positions), self.dim), dtype=np.float32)
+        result[in_base] = self._get_base(positions[in_base])
+        result[~in_base] = tail[positions[~in_base] - self.base_count]
+        return result
+
+    def save(self, path: str) -> None:
+        """
+        Write every vector to a .npy file.
+
+        The file is written next to the target and renamed over it, so workers that memory-mapped
+        the previous file keep reading valid data.
+
+        Args:
+            path (str): The path of the .npy file.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, self.get(np.arange(len(self))))
+        os.replace(tmp_path, path)
+
+    def _get_base(self, positions: np.ndarray) -> np.ndarray:
+        if self.base is not None:
+            return np.asarray(self.base[positions], dtype=np.float32)
+        return reconstruct_vectors(self.fallback_index, positions)
+
+    def _get_tail(self) -> np.ndarray:
+        if self._tail is None:
+            self._tail = np.concatenate(self._appended) if self._appended else np.zeros((0, self.dim), dtype=np.float32)
+            self._appended = [self._tail]
+        return self._tail
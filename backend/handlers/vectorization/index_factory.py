@@ -0,0 +1,315 @@
+import math
+import faiss
+import numpy as np
+from utils.env_vars import (
+    FAISS_INDEX_TYPE, FAISS_ANN_MIN_VECTORS, FAISS_RETRAIN_GROWTH,
+    FAISS_IVF_NLIST, FAISS_IVF_NPROBE, FAISS_HNSW_M, FAISS_HNSW_EF_CONSTRUCTION, FAISS_HNSW_EF_SEARCH,
+    FAISS_COMPRESSION, FAISS_PQ_M, FAISS_INDEX_DIMENSIONS
+)
+
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+COMPRESSION_TYPES = ("none", "fp16", "sq8", "pq")
+# Number of stored vectors used as queries when checking the recall of an approximate index
+RECALL_SAMPLE_SIZE = 100
+RECALL_K = 10
+
+def get_target_index_type(ntotal: int, index_type: str = FAISS_INDEX_TYPE) -> str:
+    """
+    Get the index type a shard of a given size should use.
+
+    Approximate indexes only pay off on large shards, and IVF cannot be trained on a handful of
+    vectors, so shards smaller than FAISS_ANN_MIN_VECTORS always use an exact flat index.
+
+    Args:
+        ntotal (int): The number of vectors in the shard.
+        index_type (str): The configured index type.
+
+    Returns:
+        str: One of INDEX_TYPES.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Index type {index_type} is not supported. Supported types are: {', '.join(INDEX_TYPES)}.")
+    if ntotal < FAISS_ANN_MIN_VECTORS:
+        return "flat"
+    return index_type
+
+def get_target_compression(ntotal: int, compression: str = FAISS_COMPRESSION) -> str:
+    """
+    Get the vector compression a shard of a given size should use.
+
+    Quantizers need enough training data and only save meaningful memory on large shards, so
+    shards smaller than FAISS_ANN_MIN_VECTORS always store their vectors uncompressed.
+
+    Args:
+        ntotal (int): The number of vectors in the shard.
+        compression (str): The configured compression.
+
+    Returns:
+        str: One of COMPRESSION_TYPES.
+    """
+    if compression not in COMPRESSION_TYPES:
+        raise ValueError(f"Compression {compression} is not supported. Supported compressions are: {', '.join(COMPRESSION_TYPES)}.")
+    if ntotal < FAISS_ANN_MIN_VECTORS:
+        return "none"
+    return compression
+
+def get_pq_m(dim: int) -> int:
+    """
+    Get the number of product quantizer sub-vectors for a dimension.
+
+    Args:
+        dim (int): The dimension of the vectors.
+
+    Returns:
+        int: FAISS_PQ_M, or one sub-vector per 8 dimensions when it is not set.
+    """
+    m = FAISS_PQ_M or max(1, dim // 8)
+    if dim % m:
+        raise ValueError(f"FAISS_PQ_M ({m}) must divide the vector dimension ({dim}).")
+    return m
+
+def get_factory_string(dim: int, index_type: str, compression: str, nlist: int = 0) -> str:
+    """
+    Get the `faiss.index_factory` description of an index.
+
+    Args:
+        dim (int): The dimension of the vectors.
+        index_type (str): One of INDEX_TYPES.
+        compression (str): One of COMPRESSION_TYPES.
+        nlist (int): The number of IVF lists.
+
+    Returns:
+        str: The factory string, e.g. "IVF400,SQ8" or "HNSW32_PQ96".
+    """
+    codec = {"none": "Flat", "fp16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{get_pq_m(dim) if compression == 'pq' else 0}"}[compression]
+    if index_type == "ivf":
+        return f"IVF{nlist},{codec}"
+    if index_type == "hnsw":
+        return f"HNSW{FAISS_HNSW_M}" if compression == "none" else f"HNSW{FAISS_HNSW_M}_{codec}"
+    if compression == "pq":
+        # IndexPQ rejects search parameters and with them ID selectors, a single IVF list scans just as exhaustively
+        return f"IVF1,{codec}"
+    return codec
+
+def get_index_dimensions(full_dim: int, dimensions: int = FAISS_INDEX_DIMENSIONS) -> int:
+    """
+    Get the number of leading embedding dimensions stored in the FAISS index.
+
+    Args:
+        full_dim (int): The dimension of the embeddings.
+        dimensions (int): The configured index dimension, 0 keeps every dimension.
+
+    Returns:
+        int: The index dimension, never more than the embedding dimension.
+    """
+    return dimensions if 0 < dimensions < full_dim else full_dim
+
+def truncate_vectors(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """
+    Keep the leading dimensions of embeddings, scaled back to unit length.
+
+    Matryoshka trained embeddings such as OpenAI's text-embedding-3 models concentrate the most
+    information in their first dimensions, so a prefix is a smaller embedding of the same text.
+
+    Args:
+        vectors (np.ndarray): The (n, full_dim) embeddings.
+        dim (int): The number of dimensions to keep.
+
+    Returns:
+        np.ndarray: The (n, dim) truncated embeddings, the input itself when nothing is cut.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.shape[1] == dim:
+        return vectors
+    truncated = vectors[:, :dim]
+    return np.ascontiguousarray(truncated / np.maximum(np.linalg.norm(truncated, axis=1, keepdims=True), 1e-12))
+
+def build_index(vectors: np.ndarray, dim: int, index_type: str = FAISS_INDEX_TYPE, compression: str = FAISS_COMPRESSION) -> tuple:
+    """
+    Build, train if needed, and fill an index of the configured type and compression.
+
+    Args:
+        vectors (np.ndarray): The (n, dim) float32 vectors to index, in position order.
+        dim (int): The dimension of the vectors.
+        index_type (str): The configured index type.
+        compression (str): The configured vector compression.
+
+    Returns:
+        tuple: The FAISS index and a metadata dict describing how it was built.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, dim)
+    ntotal = len(vectors)
+    target = get_target_index_type(ntotal, index_type)
+    target_compression = get_target_compression(ntotal, compression)
+    meta = {"index_type": target, "compression": target_compression, "trained_on": ntotal, "dimensions": dim}
+
+    nlist = 0
+    if target == "ivf":
+        # Rule of thumb from the FAISS wiki, capped so every centroid gets enough training points
+        nlist = FAISS_IVF_NLIST or int(4 * math.sqrt(ntotal))
+        nlist = max(1, min(nlist, ntotal // 39))
+        meta["nlist"] = nlist
+
+    if target == "flat" and target_compression == "none":
+        index = faiss.IndexFlatL2(dim)
+    else:
+        meta["factory"] = get_factory_string(dim, target, target_compression, nlist)
+        index = faiss.index_factory(dim, meta["factory"], faiss.METRIC_L2)
+
+    if target == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        # IVF needs ~39 points per list and quantizers ~256 per code, more only slows training down
+        index.train(vectors[np.random.default_rng(0).permutation(ntotal)[:256 * max(nlist, 256)]])
+    index.add(vectors)
+    if target == "ivf":
+        # Keep a position -> list entry map so vectors can be reconstructed when rebuilding
+        faiss.downcast_index(index).make_direct_map()
+
+    if target != "flat" or target_compression != "none":
+        meta["recall_at_k"] = recall_at_k(index, vectors, vectors[:RECALL_SAMPLE_SIZE], RECALL_K)
+    return index, meta
+
+def needs_rebuild(meta: dict, ntotal: int, index_type: str = FAISS_INDEX_TYPE, compression: str = FAISS_COMPRESSION) -> bool:
+    """
+    Check whether a shard's index no longer matches its size or the configured type and compression.
+
+    IVF indexes are retrained once the shard grew by FAISS_RETRAIN_GROWTH since the last training,
+    since the centroids no longer describe the data well.
+
+    Args:
+        meta (dict): The metadata returned by `build_index` when the index was built.
+        ntotal (int): The current number of live vectors.
+        index_type (str): The configured index type.
+        compression (str): The configured vector compression.
+
+    Returns:
+        bool: True if the index should be rebuilt.
+    """
+    target = get_target_index_type(ntotal, index_type)
+    if meta.get("index_type", "flat") != target:
+        return True
+    if meta.get("compression", "none") != get_target_compression(ntotal, compression):
+        return True
+    return target == "ivf" and ntotal >= FAISS_RETRAIN_GROWTH * meta.get("trained_on", 0)
+
+def stores_full_vectors(index, meta: dict, full_dim: int) -> bool:
+    """
+    Check whether an index holds the embeddings exactly, so they can be read back from it.
+
+    Args:
+        index: The FAISS index.
+        meta (dict): The metadata returned by `build_index`.
+        full_dim (int): The dimension of the embeddings.
+
+    Returns:
+        bool: True if the index is uncompressed and keeps every dimension.
+    """
+    return meta.get("compression", "none") == "none" and index.d == full_dim
+
+def is_approximate(index) -> bool:
+    """
+    Check whether an index returns approximate results.
+
+    Args:
+        index: The FAISS index.
+
+    Returns:
+        bool: True for IVF and HNSW indexes.
+    """
+    index = faiss.downcast_index(index)
+    return isinstance(index, (faiss.IndexIVF, faiss.IndexHNSW))
+
+def search_parameters(index, selector=None):
+    """
+    Build the search parameters for an index, applying the configured nprobe / efSearch.
+
+    Args:
+        index: The FAISS index.
+        selector: Optional FAISS ID selector restricting the searched vectors.
+
+    Returns:
+        faiss.SearchParameters: The parameters to pass to `index.search`.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = FAISS_IVF_NPROBE
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = FAISS_HNSW_EF_SEARCH
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+def reconstruct_vectors(index, positions) -> np.ndarray:
+    """
+    Read back the stored vectors at the given positions.
+
+    Args:
+        index: The FAISS index.
+        positions: The internal positions to reconstruct.
+
+    Returns:
+        np.ndarray: A (len(positions), dim) float32 array.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+
+    downcast = faiss.downcast_index(index)
+    if isinstance(downcast, faiss.IndexIVF) and downcast.direct_map.type == faiss.DirectMap.NoMap:
+        downcast.make_direct_map()
+    return downcast.reconstruct_batch(positions)
+
+def recall_at_k(index, vectors: np.ndarray, queries: np.ndarray, k: int) -> float:
+    """
+    Measure the recall@k of an index against an exact search over the same vectors.
+
+    Args:
+        index: The FAISS index to check.
+        vectors (np.ndarray): The vectors stored in the index, in position order.
+        queries (np.ndarray): The query vectors.
+        k (int): The number of neighbours to compare.
+
+    Returns:
+        float: The share of the exact top k neighbours that the index also returned.
+    """
+    if len(vectors) == 0 or len(queries) == 0:
+        return 1.0
+
+    k = min(k, len(vectors))
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, expected = exact.search(queries, k)
+    _, found = index.search(queries, k, params=search_parameters(index))
+
+    hits = sum(len(set(expected_row) & set(found_row)) for expected_row, found_row in zip(expected, found))
+    return hits / expected.size
+
+def rerank(queries: np.ndarray, candidates: np.ndarray, full_vectors, k: int) -> tuple:
+    """
+    Re-rank the candidates of a compressed index by their exact distance to the queries.
+
+    Args:
+        queries (np.ndarray): The (nq, dim) query vectors.
+        candidates (np.ndarray): The (nq, n) candidate positions returned by the index, -1 for none.
+        full_vectors: Any object whose `get(positions)` returns the full precision vectors.
+        k (int): The number of results to keep per query.
+
+    Returns:
+        tuple: The (nq, k) exact distances and positions, padded with inf / -1.
+    """
+    distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    positions = np.full((len(queries), k), -1, dtype=np.int64)
+    for row, (query, row_candidates) in enumerate(zip(queries, candidates)):
+        row_candidates = row_candidates[row_candidates != -1]
+        if len(row_candidates) == 0:
+            continue
+        row_distances = ((full_vectors.get(row_candidates) - query) ** 2).sum(axis=1)
+        order = np.argsort(row_distances, kind="stable")[:k]
+        distances[row, :len(order)] = row_distances[order]
+        positions[row, :len(order)] = row_candidates[order]
+    return distances, positions
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+from .vector_shard import VectorShard
+from utils.env_vars import FAISS_MAX_OPEN_SHARDS, FAISS_WAL_COMPACT_BYTES, FAISS_COMPACT_INTERVAL, FAISS_TOMBSTONE_COMPACT_RATIO
+
+class IndexManager:
+    """
+    Process-wide cache of FAISS index shards loaded from disk.
+
+    Every index directory (one per user shard) is opened at most once per worker, its base snapshot
+    memory-mapped. On every access the shard replays the WAL records appended since the last
+    access and reloads completely only when another worker published a new base generation.
+    At most `max_open` shards are kept open, the least recently used one is evicted first.
+
+    A background compactor folds the WAL of open shards into a new base snapshot once it grows
+    past `compact_bytes` or once more than `tombstone_ratio` of the shard's vectors are deleted.
+    """
+
+    def __init__(self, max_open: int = FAISS_MAX_OPEN_SHARDS,
+                 compact_bytes: int = FAISS_WAL_COMPACT_BYTES,
+                 compact_interval: float = FAISS_COMPACT_INTERVAL,
+                 tombstone_ratio: float = FAISS_TOMBSTONE_COMPACT_RATIO):
+        self.max_open = max_open
+        self.compact_bytes = compact_bytes
+        self.compact_interval = compact_interval
+        self.tombstone_ratio = tombstone_ratio
+        self._lock = threading.Lock()
+        self._dir_locks = {}
+        self._shards = OrderedDict()
+        self._compactor = None
+
+    def lock(self, index_dir: str) -> threading.RLock:
+        """
+        Get the in-process lock guarding an index directory.
+
+        The lock must be held while reading from or mutating the shard's FAISS object, since
+        FAISS indexes are not safe to search while vectors are being added or removed.
+
+        Args:
+            index_dir (str): The directory the index is stored in.
+
+        Returns:
+            threading.RLock: The lock for the given directory.
+        """
+        with self._lock:
+            if index_dir not in self._dir_locks:
+                self._dir_locks[index_dir] = threading.RLock()
+            return self._dir_locks[index_dir]
+
+    def get_shard(self, index_dir: str) -> VectorShard:
+        """
+        Get the up to date shard for a directory, loading it from disk only when needed.
+
+        Args:
+            index_dir (str): The directory the index is stored in.
+
+        Returns:
+            VectorShard: The cached shard. It is empty if nothing was written yet.
+        """
+        self._ensure_compactor()
+
+        with self.lock(index_dir):
+            with self._lock:
+                shard = self._shards.get(index_dir)
+            if shard is None:
+                shard = VectorShard(index_dir, self.lock(index_dir))
+
+            shard.refresh()
+
+            with self._lock:
+                self._shards[index_dir] = shard
+                self._shards.move_to_end(index_dir)
+                while len(self._shards) > self.max_open:
+                    # Evicted shards are simply reloaded from disk on their next access
+                    self._shards.popitem(last=False)
+
+            return shard
+
+    def invalidate(self, index_dir: str) -> None:
+        """
+        Drop a cached shard so that the next access reloads it from disk.
+
+        Args:
+            index_dir (str): The directory the index is stored in.
+        """
+        with self.lock(index_dir):
+            with self._lock:
+                self._shards.pop(index_dir, None)
+
+    def compact_pending(self) -> int:
+        """
+        Compact every open shard whose WAL or tombstones have grown past the configured thresholds.
+
+        Returns:
+            int: The number of shards that were compacted.
+        """
+        with self._lock:
+            shards = list(self._shards.values())
+
+        compacted = 0
+        for shard in shards:
+            if not shard.needs_compaction(self.compact_bytes, self.tombstone_ratio):
+                continue
+            try:
+                if shard.compact():
+                    compacted += 1
+            except Exception as e:
+                print(f"Error compacting FAISS shard {shard.index_dir}: {e}")
+        return compacted
+
+    def _ensure_compactor(self) -> None:
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self._compact_loop, name="faiss-compactor", daemon=True)
+            self._compactor.start()
+
+    def _compact_loop(self) -> None:
+        while True:
+            time.sleep(self.compact_interval)
+            self.compact_pending()
+
+index_manager = IndexManager()
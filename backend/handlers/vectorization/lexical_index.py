@@ -0,0 +1,126 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+# Standard BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Rank offset of reciprocal rank fusion, 60 is the value from the original paper
+RRF_K = 60
+
+# Words, numbers and IDs, so that names, dates and identifiers match exactly
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: str) -> list:
+    """
+    Split a text into lowercase lexical terms.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        list: The terms of the text, in order, with repetitions.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+def term_frequencies(text: str) -> tuple:
+    """
+    Count the terms of a text.
+
+    Args:
+        text (str): The text to index.
+
+    Returns:
+        tuple: A term -> frequency dict and the total number of terms.
+    """
+    terms = tokenize(text)
+    return Counter(terms), len(terms)
+
+class LexicalIndex:
+    """
+    In-memory inverted index over the documents added to a shard since its base snapshot.
+
+    The base snapshot's inverted index is stored in the docstore file, this one only covers the
+    overlay. Deleted documents stay indexed until the next compaction and are filtered out at
+    query time, like their vectors.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.lengths = {}
+        self.total_length = 0
+
+    def add(self, position: int, text: str) -> None:
+        """
+        Index a document.
+
+        Args:
+            position (int): The internal position of the document.
+            text (str): The text of the document.
+        """
+        frequencies, length = term_frequencies(text)
+        for term, frequency in frequencies.items():
+            self.postings[term][position] = frequency
+        self.lengths[position] = length
+        self.total_length += length
+
+    def get_postings(self, terms: list) -> list:
+        """
+        Get the postings of the given terms.
+
+        Args:
+            terms (list): The query terms.
+
+        Returns:
+            list: (term, position, frequency, document length) tuples.
+        """
+        return [
+            (term, position, frequency, self.lengths[position])
+            for term in terms
+            for position, frequency in self.postings.get(term, {}).items()
+        ]
+
+def bm25_scores(terms: list, postings: list, doc_count: int, average_length: float) -> dict:
+    """
+    Score documents against query terms with Okapi BM25.
+
+    Args:
+        terms (list): The distinct query terms.
+        postings (list): (term, position, frequency, document length) tuples of every document containing a term.
+        doc_count (int): The number of documents in the corpus.
+        average_length (float): The average number of terms per document.
+
+    Returns:
+        dict: Position -> score, higher is more relevant.
+    """
+    document_frequencies = Counter(term for term, _, _, _ in postings)
+    idf = {
+        term: math.log(1 + (doc_count - document_frequencies[term] + 0.5) / (document_frequencies[term] + 0.5))
+        for term in terms
+    }
+
+    scores = defaultdict(float)
+    average_length = average_length or 1
+    for term, position, frequency, length in postings:
+        normalization = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+        scores[position] += idf[term] * frequency * (BM25_K1 + 1) / (frequency + normalization)
+    return scores
+
+def reciprocal_rank_fusion(rankings: list, k: int) -> list:
+    """
+    Fuse several rankings of the same documents with reciprocal rank fusion.
+
+    Only ranks are used, so rankings with incomparable scores (distances and BM25) can be fused.
+
+    Args:
+        rankings (list): Lists of document IDs, best first.
+        k (int): The number of fused results to return.
+
+    Returns:
+        list: The best k document IDs by fused score.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1 / (RRF_K + rank + 1)
+    return sorted(scores, key=lambda doc_id: scores[doc_id], reverse=True)[:k]
@@ -0,0 +1,41 @@
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # flock is not available on Windows, where the backend only runs as a single dev process
+    fcntl = None
+
+class FileLock:
+    """
+    Advisory cross-process lock backed by `flock` on a lock file.
+
+    Shared locks can be held by many processes at once, an exclusive lock waits for all of them
+    to be released and blocks new ones until it is released. A non-blocking lock raises
+    `BlockingIOError` instead of waiting when it is held elsewhere.
+    """
+
+    def __init__(self, path: str, shared: bool = False, blocking: bool = True):
+        self.path = path
+        self.shared = shared
+        self.blocking = blocking
+        self._fd = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            operation = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+            try:
+                fcntl.flock(self._fd, operation if self.blocking else operation | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(self._fd)
+                self._fd = None
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
@@ -1,3 +1,16 @@
 from langchain_openai import OpenAIEmbeddings
 
-embedder = OpenAIEmbeddings(model="text-embedding-3-small")
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+def get_openai_embeddings(dimensions: int = 0) -> OpenAIEmbeddings:
+    """
+    Create the OpenAI embeddings client.
+
+    Args:
+        dimensions (int): The dimension of the embeddings, 0 keeps the model's native dimension.
+
+    Returns:
+        OpenAIEmbeddings: The embeddings client.
+    """
+    # text-embedding-3 models shorten their embeddings server side when asked for fewer dimensions
+    return OpenAIEmbeddings(model=EMBEDDING_MODEL, dimensions=dimensions or None)
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+from .embedders import embedder
+from utils.env_vars import QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire `ttl` seconds after being set.
+
+    Hits and misses are counted so the effectiveness of the cache can be monitored.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Get a cached value.
+
+        Args:
+            key: The key of the entry.
+
+        Returns:
+            The cached value, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value) -> None:
+        """
+        Cache a value, evicting the least recently used entry if the cache is full.
+
+        Args:
+            key: The key of the entry.
+            value: The value to cache.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Drop every cached entry.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the hit and miss counters of the cache.
+
+        Returns:
+            dict: The number of hits, misses and cached entries.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+query_embeddings = TTLCache(QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL)
+# Keyed by (index_dir, shard version, query, k, source), so any write to a shard invalidates its results
+search_results = TTLCache(QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL)
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a search query so that trivially different spellings share cache entries.
+
+    Args:
+        query (str): The raw search query.
+
+    Returns:
+        str: The query with surrounding whitespace removed and inner whitespace collapsed.
+    """
+    return " ".join(query.split())
+
+def embed_query(query: str) -> list:
+    """
+    Embed a search query, reusing the embedding of a recent identical query.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        list: The query embedding.
+    """
+    query = normalize_query(query)
+    embedding = query_embeddings.get(query)
+    if embedding is None:
+        embedding = embedder.embed_query(query)
+        query_embeddings.set(query, embedding)
+    return embedding
+
+def embed_queries(queries: list) -> list:
+    """
+    Embed several search queries, sending every query missing from the cache in one batch.
+
+    Args:
+        queries (list): The search queries.
+
+    Returns:
+        list: The embedding of every query, in order.
+    """
+    queries = [normalize_query(query) for query in queries]
+    embeddings = {}
+    for query in queries:
+        embedding = query_embeddings.get(query)
+        if embedding is not None:
+            embeddings[query] = embedding
+
+    missing = [query for query in dict.fromkeys(queries) if query not in embeddings]
+    if missing:
+        for query, embedding in zip(missing, embedder.embed_documents(missing)):
+            query_embeddings.set(query, embedding)
+            embeddings[query] = embedding
+
+    return [embeddings[query] for query in queries]
+
+def get_cache_stats() -> dict:
+    """
+    Get the hit and miss counters of the query caches.
+
+    Returns:
+        dict: The stats of the query embedding and search result caches.
+    """
+    return {
+        "query_embeddings": query_embeddings.stats(),
+        "search_results": search_results.stats(),
+    }
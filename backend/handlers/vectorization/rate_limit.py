@@ -0,0 +1,69 @@
+import threading
+import time
+
+# Rough number of characters per token, used to charge a tokens budget before a request
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text without a tokenizer.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens, at least 1.
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+class RateLimiter:
+    """
+    Token bucket spreading a budget per minute, e.g. of embedding requests or tokens, across threads.
+
+    The bucket starts full and refills continuously, so short bursts up to a minute's budget go
+    through at once and sustained use is held to the rate. Reserving more than is available puts
+    the bucket in debt, and the caller waits until the debt is paid back, so reservations are
+    served in order and a large one is never starved by small ones.
+    """
+
+    def __init__(self, per_minute: float):
+        """
+        Args:
+            per_minute (float): The budget per minute, 0 or less disables the limit.
+        """
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        Take an amount from the budget.
+
+        Args:
+            amount (float): The amount used, negative to give back part of an earlier reservation.
+
+        Returns:
+            float: The number of seconds to wait before using it.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            # A negative amount gives back what was reserved in excess, up to a full bucket
+            self.available = min(self.capacity, self.available - amount)
+            return max(0.0, -self.available / self.rate)
+
+    def acquire(self, amount: float = 1) -> None:
+        """
+        Take an amount from the budget, waiting until it is available.
+
+        Args:
+            amount (float): The amount used.
+        """
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
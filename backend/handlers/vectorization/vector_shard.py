@@ -0,0 +1,963 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import defaultdict
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from .embedders import embedder
+from .wal import WriteAheadLog, encode_vectors, decode_vectors
+from .locks import FileLock
+from .index_factory import build_index, needs_rebuild, is_approximate, search_parameters, rerank, get_index_dimensions, truncate_vectors, stores_full_vectors
+from .full_vectors import FullVectorStore
+from .docstore import ShardDocstore, FILTER_FIELDS, LOOKUP_BATCH_SIZE
+from .lexical_index import LexicalIndex, tokenize, bm25_scores
+from utils.env_vars import FAISS_ANN_MIN_VECTORS, FAISS_RERANK_FACTOR, FAISS_MMAP_INDEX, FAISS_RERANK_FULL_DIMENSIONS
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite3"
+# Pickled LangChain docstore of snapshots written before DOCSTORE_FILE existed
+LEGACY_DOCSTORE_FILE = "index.pkl"
+INDEX_META_FILE = "index.json"
+VECTORS_FILE = "vectors.npy"
+# Every generation is written to its own directory under SNAPSHOTS_DIR, CURRENT names the published one
+SNAPSHOTS_DIR = "snapshots"
+CURRENT_FILE = "CURRENT"
+# Generation of snapshots written directly into the shard directory, before SNAPSHOTS_DIR existed
+VERSION_FILE = "VERSION"
+SNAPSHOT_FILES = (INDEX_FILE, DOCSTORE_FILE, LEGACY_DOCSTORE_FILE, INDEX_META_FILE, VECTORS_FILE, VERSION_FILE)
+LOCK_FILE = "LOCK"
+COMPACT_LOCK_FILE = "COMPACT.lock"
+# Nearest neighbours compared with every new document when looking for near-duplicates
+DEDUP_CANDIDATES = 4
+
+def read_generation(index_dir: str) -> str | None:
+    """
+    Read the generation of the base snapshot stored in an index directory.
+
+    Falls back to the VERSION file of snapshots written directly into the index directory, and to
+    the modification time and size of the index files for directories written before that.
+
+    Args:
+        index_dir (str): The directory the index is stored in.
+
+    Returns:
+        str | None: The generation token, or None if no base snapshot exists on disk.
+    """
+    for file_name in (CURRENT_FILE, VERSION_FILE):
+        try:
+            with open(os.path.join(index_dir, file_name), "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            pass
+
+    try:
+        index_stat = os.stat(os.path.join(index_dir, INDEX_FILE))
+        docstore_stat = os.stat(os.path.join(index_dir, LEGACY_DOCSTORE_FILE))
+    except FileNotFoundError:
+        return None
+    return f"{index_stat.st_mtime_ns}-{index_stat.st_size}-{docstore_stat.st_mtime_ns}-{docstore_stat.st_size}"
+
+def merge_metadata(existing: dict, duplicate: dict) -> dict:
+    """
+    Merge the metadata of a skipped near-duplicate into the document it duplicates.
+
+    The stored document keeps its own values, gains the keys it was missing, and counts how many
+    times it was seen along with when it was last seen.
+
+    Args:
+        existing (dict): The metadata of the stored document.
+        duplicate (dict): The metadata of the skipped document.
+
+    Returns:
+        dict: The merged metadata.
+    """
+    merged = {**duplicate, **existing, "seen_count": existing.get("seen_count", 1) + 1}
+    if "created_at" in duplicate:
+        merged["last_seen_at"] = duplicate["created_at"]
+    return merged
+
+def get_snapshot_dir(index_dir: str, generation: str) -> str:
+    """
+    Get the directory holding the files of a base snapshot.
+
+    Args:
+        index_dir (str): The directory the index is stored in.
+        generation (str): The generation of the snapshot.
+
+    Returns:
+        str: The snapshot directory, the index directory itself for snapshots written before SNAPSHOTS_DIR existed.
+    """
+    snapshot_dir = os.path.join(index_dir, SNAPSHOTS_DIR, generation)
+    return snapshot_dir if os.path.isdir(snapshot_dir) else index_dir
+
+def get_wal_path(index_dir: str, generation: str | None) -> str:
+    """
+    Get the path of the WAL holding the writes made on top of a base snapshot.
+
+    Args:
+        index_dir (str): The directory the index is stored in.
+        generation (str | None): The generation of the base snapshot.
+
+    Returns:
+        str: The path of the WAL file.
+    """
+    return os.path.join(index_dir, f"wal-{generation or 'initial'}.log")
+
+class VectorShard:
+    """
+    In-memory view of one index directory: the base snapshot plus the WAL replayed on top of it.
+
+    Writes are appended to the WAL of the current generation and applied to an in-memory delta
+    index, so they never rewrite the snapshot. Deletes only record tombstones, which are filtered
+    out at search time. `compact` folds the WAL into a fresh base snapshot, physically removing the
+    tombstoned vectors, and starts a new generation. Appends hold an exclusive lock on the
+    directory, loads of the base snapshot hold a shared one.
+
+    Every generation is written to its own snapshot directory and published by atomically
+    replacing the CURRENT pointer, so a reader always opens the files of a single, complete
+    snapshot. A compaction builds the new snapshot from a frozen view of the shard without holding
+    any lock, so searches, loads and writes carry on meanwhile. It then takes the exclusive lock
+    only to carry the WAL records written in the meantime over to the new generation and swap
+    CURRENT.
+
+    The base snapshot is opened read-only and memory-mapped: the FAISS index through FAISS' mmap
+    flags and the documents through a SQLite file, so every worker on a host shares the same page
+    cache pages and opening a shard does not deserialize it. Snapshot files are only ever replaced
+    by publishing a new directory, which keeps the mappings of workers still on the previous
+    generation valid.
+
+    Nothing is read eagerly when a shard is opened: document IDs and filterable metadata values are
+    resolved to internal FAISS positions through the docstore's indexes, plus an in-memory inverted
+    index for the documents added since the snapshot. Filtered searches run as FAISS subset searches
+    through an `IDSelector` and return the exact top k among the matching documents. A BM25
+    inverted index over the same documents, split the same way between the docstore file and
+    memory, serves lexical searches.
+
+    The type of the FAISS index (flat, IVF or HNSW) is chosen by `index_factory` whenever the shard
+    is rebuilt during compaction, based on the configured type and the size of the shard. Large
+    shards can additionally store compressed codes in the index, the full precision vectors are then
+    kept memory-mapped next to the snapshot and used to re-rank the index's candidates exactly.
+    """
+
+    def __init__(self, index_dir: str, lock: threading.RLock = None):
+        self.index_dir = index_dir
+        self.lock = lock or threading.RLock()
+        self.generation = None
+        self.index = None
+        self.delta = None
+        self.size = 0
+        self.docstore = ShardDocstore()
+        self.index_meta = {}
+        self.full_vectors = FullVectorStore()
+        self.tombstones = {}
+        self.positions = {}
+        self.postings = defaultdict(set)
+        self.lexical = LexicalIndex()
+        self.legacy = False
+        self.wal = None
+        self.wal_offset = 0
+        self.loaded = False
+        self.snapshot_dir = index_dir
+
+    def file_lock(self, shared: bool = False) -> FileLock:
+        """
+        Get the cross-process lock of the index directory.
+
+        Args:
+            shared (bool): Whether to take a shared (read) lock instead of an exclusive one.
+
+        Returns:
+            FileLock: The lock, to be used as a context manager.
+        """
+        return FileLock(os.path.join(self.index_dir, LOCK_FILE), shared=shared)
+
+    def refresh(self, locked: bool = False) -> None:
+        """
+        Bring the in-memory view up to date with the directory.
+
+        A new base generation triggers a full reload, otherwise only the WAL records written
+        since the last refresh (by this or another worker) are replayed.
+
+        Args:
+            locked (bool): Whether the caller already holds the directory's file lock.
+        """
+        with self.lock:
+            if not self.loaded or read_generation(self.index_dir) != self.generation:
+                self._load(locked)
+            else:
+                self._replay()
+
+    @property
+    def version(self) -> tuple:
+        """
+        Identify the state of the shard, any write changes it.
+
+        Returns:
+            tuple: The base generation and the number of WAL bytes applied on top of it.
+        """
+        return (self.generation, self.wal_offset)
+
+    def __len__(self) -> int:
+        return self.size - len(self.tombstones)
+
+    def add(self, texts: list, vectors, metadatas: list, ids: list = None) -> list:
+        """
+        Append embedded documents to the WAL and apply them to the in-memory index.
+
+        Args:
+            texts (list): The document texts.
+            vectors: The embeddings of the texts.
+            metadatas (list): The metadata of each document.
+            ids (list): Optional document IDs, random UUIDs are generated when omitted.
+
+        Returns:
+            list: The IDs of the added documents.
+        """
+        return self.replace([], texts, vectors, metadatas, ids)
+
+    def delete(self, ids: list) -> list:
+        """
+        Tombstone documents with a single WAL append.
+
+        Args:
+            ids (list): The IDs of the documents to delete.
+
+        Returns:
+            list: The IDs that existed and were deleted.
+        """
+        with self.lock:
+            if not os.path.isdir(self.index_dir):
+                return []
+
+            with self.file_lock():
+                self.refresh(locked=True)
+                deleted_ids = self._live_ids(ids)
+                if deleted_ids:
+                    self.wal.append([{"op": "delete", "ids": deleted_ids}])
+                    self._replay()
+
+        return deleted_ids
+
+    def replace(self, old_ids: list, texts: list, vectors, metadatas: list, ids: list = None) -> list:
+        """
+        Tombstone documents and add their replacements with a single WAL append.
+
+        Args:
+            old_ids (list): The IDs of the documents being replaced. Unknown IDs are ignored.
+            texts (list): The texts of the new documents.
+            vectors: The embeddings of the new texts.
+            metadatas (list): The metadata of each new document.
+            ids (list): Optional IDs for the new documents, random UUIDs are generated when omitted.
+
+        Returns:
+            list: The IDs of the new documents.
+        """
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        add_record = None
+        if texts:
+            add_record = {
+                "op": "add",
+                "ids": ids,
+                "texts": list(texts),
+                "metadatas": list(metadatas),
+                "dim": len(vectors[0]),
+                "vectors": encode_vectors(vectors),
+            }
+
+        with self.lock:
+            os.makedirs(self.index_dir, exist_ok=True)
+            with self.file_lock():
+                self.refresh(locked=True)
+                records = []
+                deleted_ids = self._live_ids(old_ids)
+                if deleted_ids:
+                    records.append({"op": "delete", "ids": deleted_ids})
+                if add_record:
+                    records.append(add_record)
+                if records:
+                    self.wal.append(records)
+                    self._replay()
+
+        return ids if texts else []
+
+    def search(self, embedding, k: int, filters: dict = None) -> list:
+        """
+        Search the shard for the documents closest to an embedding, skipping tombstones.
+
+        Args:
+            embedding: The query embedding.
+            k (int): The number of documents to return.
+            filters (dict): Optional metadata values the documents must match, keyed by a field in FILTER_FIELDS.
+
+        Returns:
+            list: The top k live documents matching the filters.
+        """
+        return [doc for doc, _ in self.search_with_scores(np.asarray([embedding], dtype=np.float32), k, filters)[0]]
+
+    def search_with_scores(self, embeddings, k: int, filters: dict = None) -> list:
+        """
+        Search the shard for several query embeddings at once, skipping tombstones.
+
+        Args:
+            embeddings: A (n, dim) array of query embeddings.
+            k (int): The number of documents to return per query.
+            filters (dict): Optional metadata values the documents must match, keyed by a field in FILTER_FIELDS.
+
+        Returns:
+            list: For every query, a list of (document, distance) tuples, closest first.
+        """
+        with self.lock:
+            queries = np.asarray(embeddings, dtype=np.float32)
+            distances, positions = self._search_positions(queries, k, filters)
+            docs = self.docstore.get_many([int(position) for position in positions.flat if position != -1])
+            results = []
+            for query_distances, query_positions in zip(distances, positions):
+                results.append([
+                    (self._to_result(docs[int(position)]), float(distance))
+                    for distance, position in zip(query_distances, query_positions)
+                    if position != -1
+                ])
+            return results
+
+    def add_unique(self, texts: list, vectors, metadatas: list, threshold: float, merge: bool = False, replaced_ids: list = None) -> tuple:
+        """
+        Add documents, skipping the near-duplicates of live documents and of earlier documents in the batch.
+
+        A document is a near-duplicate when the cosine similarity of its embedding with one of its
+        nearest neighbours reaches the threshold. The check and the write happen under the directory's
+        lock, so concurrent workers cannot both add the same document.
+
+        Args:
+            texts (list): The document texts.
+            vectors: The embeddings of the texts.
+            metadatas (list): The metadata of each document.
+            threshold (float): The cosine similarity from which a document counts as a duplicate.
+            merge (bool): Whether to merge the metadata of skipped documents into the documents they duplicate.
+            replaced_ids (list): IDs of documents the new ones replace, tombstoned in the same WAL append.
+                They are not duplicates of their replacements, so an edit keeping the text is still stored.
+
+        Returns:
+            list: A (document ID, duplicate) tuple per document, in order: the ID the document was stored
+                  under, or for skipped documents the ID of the document it duplicates.
+        """
+        if not texts:
+            self.replace(replaced_ids or [], [], [], [])
+            return []
+        vectors = np.asarray(vectors, dtype=np.float32)
+        ids = [str(uuid.uuid4()) for _ in texts]
+
+        with self.lock:
+            os.makedirs(self.index_dir, exist_ok=True)
+            with self.file_lock():
+                self.refresh(locked=True)
+                deleted_ids = self._live_ids(replaced_ids or [])
+                matches = self._find_duplicates(vectors, ids, threshold, set(deleted_ids))
+
+                added = [row for row, match in enumerate(matches) if match is None]
+                duplicates = [(row, match) for row, match in enumerate(matches) if match is not None]
+                records = []
+                if deleted_ids:
+                    records.append({"op": "delete", "ids": deleted_ids})
+                if added:
+                    records.append({
+                        "op": "add",
+                        "ids": [ids[row] for row in added],
+                        "texts": [texts[row] for row in added],
+                        "metadatas": [metadatas[row] for row in added],
+                        "dim": vectors.shape[1],
+                        "vectors": encode_vectors(vectors[added]),
+                    })
+                if merge and duplicates:
+                    records.append({
+                        "op": "merge",
+                        "ids": [match for _, match in duplicates],
+                        "metadatas": [metadatas[row] for row, _ in duplicates],
+                    })
+                if records:
+                    self.wal.append(records)
+                    self._replay()
+
+        return [(ids[row], False) if match is None else (match, True) for row, match in enumerate(matches)]
+
+    def lexical_search(self, query: str, k: int, filters: dict = None) -> list:
+        """
+        Search the shard for the documents whose text best matches the terms of a query, with BM25.
+
+        Args:
+            query (str): The search query.
+            k (int): The number of documents to return.
+            filters (dict): Optional metadata values the documents must match, keyed by a field in FILTER_FIELDS.
+
+        Returns:
+            list: Up to k (document, score) tuples, best first. Documents sharing no term with the query are not returned.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self.lock:
+            if not terms or len(self) == 0:
+                return []
+
+            allowed, excluded = self._filter_positions(filters)
+            postings = self.docstore.get_postings(terms) + self.lexical.get_postings(terms)
+            # Deleted documents still count towards the corpus statistics until the next compaction
+            average_length = (self.docstore.total_length + self.lexical.total_length) / self.size
+            scores = bm25_scores(terms, postings, self.size, average_length)
+
+            ranked = sorted(
+                (position for position in scores if position not in excluded and (allowed is None or position in allowed)),
+                key=lambda position: (-scores[position], position)
+            )[:k]
+            docs = self.docstore.get_many(ranked)
+            return [(self._to_result(docs[position]), scores[position]) for position in ranked]
+
+    def get_documents(self, ids: list) -> list:
+        """
+        Fetch live documents by their IDs.
+
+        Args:
+            ids (list): The IDs of the documents.
+
+        Returns:
+            list: The documents that exist and are not deleted, in the order of the given IDs.
+        """
+        with self.lock:
+            positions = list(self._live_positions(ids).values())
+            docs = self.docstore.get_many(positions)
+            return [self._to_result(docs[position]) for position in positions]
+
+    def get_all_documents(self, filters: dict = None) -> list:
+        """
+        Fetch every live document of the shard.
+
+        Args:
+            filters (dict): Optional metadata values the documents must match, keyed by a field in FILTER_FIELDS.
+
+        Returns:
+            list: The documents in the order they were added.
+        """
+        self._check_filters(filters)
+        with self.lock:
+            return [self._to_result(doc) for _, doc in self.docstore.iter_documents(filters) if doc.id not in self.tombstones]
+
+    def list_documents(self, limit: int, cursor: dict = None, offset: int = 0, filters: dict = None) -> tuple:
+        """
+        List one page of live documents, newest first.
+
+        A page reads only the rows it returns, plus any tombstoned rows in between. Cursors stay
+        valid across compactions: a compaction renumbers positions, in which case the cursor's
+        document is looked up again by ID, or, if it was deleted since, its old position is used,
+        which may repeat a few documents but never skips one.
+
+        Args:
+            limit (int): The maximum number of documents to return.
+            cursor (dict): The cursor returned with the previous page, None for the first page.
+            offset (int): The number of documents to skip, for clients paginating by page number.
+            filters (dict): Optional metadata values the documents must match, keyed by a field in FILTER_FIELDS.
+
+        Returns:
+            tuple: The documents, and the cursor of the next page or None if this is the last one.
+        """
+        self._check_filters(filters)
+        with self.lock:
+            before = self._resolve_cursor(cursor) if cursor else None
+            page = []
+            for position, doc in self.docstore.iter_documents(filters, before, newest_first=True):
+                if doc.id in self.tombstones:
+                    continue
+                if offset > 0:
+                    offset -= 1
+                    continue
+                page.append((position, doc))
+                # Read one document past the page to know whether there is a next one
+                if len(page) > limit:
+                    break
+
+            next_cursor = None
+            if len(page) > limit:
+                page = page[:limit]
+                position, doc = page[-1]
+                next_cursor = {"generation": self.generation, "position": position, "id": doc.id}
+            return [self._to_result(doc) for _, doc in page], next_cursor
+
+    def count(self, filters: dict = None) -> int:
+        """
+        Count the live documents of the shard.
+
+        Args:
+            filters (dict): Optional metadata values the documents must match, keyed by a field in FILTER_FIELDS.
+
+        Returns:
+            int: The number of live documents, maintained as documents are added and deleted when unfiltered.
+        """
+        with self.lock:
+            if not filters:
+                return len(self)
+            allowed, _ = self._filter_positions(filters)
+            return len(allowed)
+
+    def needs_compaction(self, wal_bytes: int, tombstone_ratio: float) -> bool:
+        """
+        Check whether the WAL or the share of tombstoned vectors has grown past a threshold,
+        the shard's size calls for a different or retrained index, or the snapshot was written
+        in an older format.
+
+        Args:
+            wal_bytes (int): The WAL size in bytes above which the shard should be compacted.
+            tombstone_ratio (float): The share of tombstoned vectors above which the shard should be compacted.
+
+        Returns:
+            bool: True if the shard should be compacted.
+        """
+        if self.wal_offset >= wal_bytes or self.legacy:
+            return True
+        if self.size == 0:
+            return False
+        if self._needs_rebuild():
+            return True
+        return len(self.tombstones) > tombstone_ratio * self.size
+
+    def compact(self, wait: bool = False) -> bool:
+        """
+        Fold the WAL into a new base snapshot and start a new, empty WAL.
+
+        The FAISS index is rebuilt without the tombstoned vectors when there are any, or when the
+        shard has outgrown its index type or IVF training. Otherwise the WAL vectors are appended
+        to a copy of the current base index. Only one worker compacts a directory at a time, the
+        others return immediately unless `wait` is set.
+
+        Args:
+            wait (bool): Whether to wait for a running compaction to finish and then compact, instead of skipping.
+
+        Returns:
+            bool: True if a new snapshot was published, False if there was nothing to compact.
+        """
+        if not os.path.isdir(self.index_dir):
+            return False
+        try:
+            with FileLock(os.path.join(self.index_dir, COMPACT_LOCK_FILE), blocking=wait):
+                return self._compact()
+        except BlockingIOError:
+            # Another worker is compacting this directory
+            return False
+
+    def reembed(self, embed) -> bool:
+        """
+        Rebuild the shard from new embeddings of its documents, e.g. after switching embedding models.
+
+        Works like `compact`, waiting for a running compaction instead of skipping it: the documents
+        are embedded and the new snapshot built from a frozen view of the shard without holding any
+        lock, then the documents written in the meantime are embedded too and the snapshot is
+        published by swapping CURRENT.
+
+        Args:
+            embed: A function taking an iterator of (IDs, texts) batches and returning the (n, dim) embeddings of all of them, in order.
+
+        Returns:
+            bool: True if a new snapshot was published, False if the shard is empty.
+        """
+        if not os.path.isdir(self.index_dir):
+            return False
+        with FileLock(os.path.join(self.index_dir, COMPACT_LOCK_FILE)):
+            return self._compact(embed)
+
+    def _compact(self, embed=None) -> bool:
+        with self.lock:
+            with self.file_lock(shared=True):
+                self.refresh(locked=True)
+            if self.size == 0:
+                return False
+
+            rebuild = embed is not None or bool(self.tombstones) or self.index is None or self._needs_rebuild()
+            if self.wal_offset == 0 and not rebuild and not self.legacy:
+                return False
+
+            # Freeze the state the snapshot is built from, records after wal_offset are carried over
+            generation, wal, wal_offset = self.generation, self.wal, self.wal_offset
+            deleted = set(self.tombstones.values())
+            order = [position for position in range(self.size) if position not in deleted] if rebuild else list(range(self.size))
+            vectors = self.full_vectors.get(order) if embed is None else None
+            docstore = self.docstore.copy()
+            index_meta = self.index_meta
+            base_index_path = os.path.join(self.snapshot_dir, INDEX_FILE)
+
+        new_generation = uuid.uuid4().hex
+        snapshots_dir = os.path.join(self.index_dir, SNAPSHOTS_DIR)
+        tmp_dir = os.path.join(snapshots_dir, f"{new_generation}.{os.getpid()}.tmp")
+        try:
+            if embed is not None:
+                vectors = embed(self._iter_texts(docstore, order))
+            if rebuild:
+                index, index_meta = self._rebuild(vectors)
+            else:
+                # Mapped indexes are read-only, append the WAL vectors to a private copy of the base index
+                index = faiss.read_index(base_index_path)
+                index.add(truncate_vectors(vectors[index.ntotal:], index.d))
+            os.makedirs(tmp_dir)
+            self._write_snapshot(tmp_dir, index, index_meta, order, vectors, docstore)
+            os.rename(tmp_dir, os.path.join(snapshots_dir, new_generation))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        finally:
+            docstore.close()
+
+        with self.lock:
+            with self.file_lock():
+                if read_generation(self.index_dir) != generation:
+                    # Published by a worker that does not take the compaction lock, keep its snapshot
+                    shutil.rmtree(os.path.join(snapshots_dir, new_generation), ignore_errors=True)
+                    return False
+
+                # Writes made while the snapshot was being built start the new generation's WAL
+                records, _ = wal.read_from(wal_offset)
+                if embed is not None:
+                    records = [self._reembed_record(record, embed) for record in records]
+                if records:
+                    WriteAheadLog(get_wal_path(self.index_dir, new_generation)).append(records)
+
+                current_path = os.path.join(self.index_dir, CURRENT_FILE)
+                tmp_path = f"{current_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(new_generation)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, current_path)
+
+                # Workers still on the old generation keep their open files, they reload on their next access
+                wal.remove()
+                self._remove_snapshots(generation, keep=new_generation)
+                self._load(locked=True)
+
+        return True
+
+    def _load(self, locked: bool) -> None:
+        self.docstore.close()
+        self.index = None
+        self.delta = None
+        self.size = 0
+        self.docstore = ShardDocstore()
+        self.index_meta = {}
+        self.full_vectors = FullVectorStore()
+        self.tombstones = {}
+        self.positions = {}
+        self.postings = defaultdict(set)
+        self.lexical = LexicalIndex()
+        self.legacy = False
+        self.wal_offset = 0
+        self.loaded = True
+        self.snapshot_dir = self.index_dir
+
+        if not os.path.isdir(self.index_dir):
+            self.generation = None
+            self.wal = WriteAheadLog(get_wal_path(self.index_dir, None))
+            return
+
+        if locked:
+            self._load_snapshot()
+        else:
+            with self.file_lock(shared=True):
+                self._load_snapshot()
+
+    def _load_snapshot(self) -> None:
+        self.generation = read_generation(self.index_dir)
+        if self.generation is not None:
+            self.snapshot_dir = get_snapshot_dir(self.index_dir, self.generation)
+            docstore_path = os.path.join(self.snapshot_dir, DOCSTORE_FILE)
+            if os.path.exists(docstore_path):
+                index_path = os.path.join(self.snapshot_dir, INDEX_FILE)
+                if FAISS_MMAP_INDEX:
+                    self.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+                else:
+                    self.index = faiss.read_index(index_path)
+                self.docstore = ShardDocstore(docstore_path)
+                self.size = self.docstore.base_count
+                # Snapshots written before the lexical index existed are rewritten by the next compaction
+                self.legacy = not self.docstore.has_postings
+            else:
+                self._load_legacy_snapshot()
+
+            self.full_vectors = FullVectorStore.load(os.path.join(self.snapshot_dir, VECTORS_FILE), self.index)
+            try:
+                with open(os.path.join(self.snapshot_dir, INDEX_META_FILE), "r") as f:
+                    self.index_meta = json.load(f)
+            except FileNotFoundError:
+                pass
+        self.wal = WriteAheadLog(get_wal_path(self.index_dir, self.generation))
+        self._replay()
+
+    def _load_legacy_snapshot(self) -> None:
+        # Snapshots written by LangChain's save_local are unpickled once, the next compaction converts them
+        legacy_index = FAISS.load_local(self.index_dir, embedder, allow_dangerous_deserialization=True)
+        self.index = legacy_index.index
+        for position in range(len(legacy_index.index_to_docstore_id)):
+            doc_id = legacy_index.index_to_docstore_id[position]
+            doc = legacy_index.docstore.search(doc_id)
+            self.docstore.add(position, doc_id, doc.page_content, doc.metadata)
+            self._index_document(position, doc_id, doc.page_content, doc.metadata)
+        self.size = len(legacy_index.index_to_docstore_id)
+        self.legacy = True
+
+    def _replay(self) -> None:
+        records, self.wal_offset = self.wal.read_from(self.wal_offset)
+        for record in records:
+            self._apply(record)
+
+    def _apply(self, record: dict) -> None:
+        if record["op"] == "add":
+            vectors = decode_vectors(record["vectors"], record["dim"])
+            if self.delta is None:
+                self.delta = faiss.IndexFlatL2(self._index_dimensions(record["dim"]))
+            self.delta.add(truncate_vectors(vectors, self.delta.d))
+            self.full_vectors.append(vectors)
+
+            for doc_id, text, metadata in zip(record["ids"], record["texts"], record["metadatas"]):
+                self.docstore.add(self.size, doc_id, text, metadata)
+                self._index_document(self.size, doc_id, text, metadata)
+                self.size += 1
+        elif record["op"] == "delete":
+            self.tombstones.update(self._live_positions(record["ids"]))
+        elif record["op"] == "merge":
+            for doc_id, metadata in zip(record["ids"], record["metadatas"]):
+                position = self._live_positions([doc_id]).get(doc_id)
+                if position is not None:
+                    existing = self.docstore.get_many([position])[position]
+                    self.docstore.update_metadata(position, merge_metadata(existing.metadata, metadata))
+
+    def _resolve_cursor(self, cursor: dict) -> int:
+        if cursor.get("generation") == self.generation:
+            return cursor["position"]
+        # Positions were renumbered by a compaction since the cursor was issued
+        doc_id = cursor.get("id")
+        position = self.positions.get(doc_id)
+        if position is None:
+            position = self.docstore.find_positions([doc_id]).get(doc_id)
+        return position if position is not None else cursor["position"]
+
+    def _live_ids(self, ids: list) -> list:
+        return list(self._live_positions(ids))
+
+    def _live_positions(self, ids: list) -> dict:
+        """
+        Resolve document IDs to positions, dropping unknown and deleted IDs.
+        """
+        ids = [doc_id for doc_id in dict.fromkeys(ids) if doc_id not in self.tombstones]
+        found = self.docstore.find_positions([doc_id for doc_id in ids if doc_id not in self.positions])
+        found.update((doc_id, self.positions[doc_id]) for doc_id in ids if doc_id in self.positions)
+        return {doc_id: found[doc_id] for doc_id in ids if doc_id in found}
+
+    def _index_document(self, position: int, doc_id: str, text: str, metadata: dict) -> None:
+        # Only documents missing from the snapshot file are indexed in memory
+        self.positions[doc_id] = position
+        self.lexical.add(position, text)
+        for field in FILTER_FIELDS:
+            if field in metadata:
+                self.postings[(field, metadata[field])].add(position)
+
+    def _index_dimensions(self, full_dim: int) -> int:
+        # Indexes keep the dimension they were built with until a compaction rebuilds them
+        if self.index is not None:
+            return self.index.d
+        if self.delta is not None:
+            return self.delta.d
+        return get_index_dimensions(full_dim)
+
+    def _needs_rebuild(self) -> bool:
+        if self.index is None:
+            return False
+        return needs_rebuild(self.index_meta, len(self)) or self.index.d != get_index_dimensions(self.full_vectors.dim)
+
+    def _base_count(self) -> int:
+        return self.index.ntotal if self.index is not None else 0
+
+    def _filter_positions(self, filters: dict) -> tuple:
+        """
+        Resolve metadata filters and tombstones to internal positions.
+
+        Returns the allowed positions (None when no filter applies) and the tombstoned positions.
+        """
+        self._check_filters(filters)
+        excluded = set(self.tombstones.values())
+
+        allowed = None
+        for field, value in (filters or {}).items():
+            matching = self.postings.get((field, value), set()) | self.docstore.filter_positions(field, value)
+            allowed = matching if allowed is None else allowed & matching
+
+        if allowed is not None:
+            allowed = allowed - excluded
+        return allowed, excluded
+
+    def _check_filters(self, filters: dict) -> None:
+        for field in filters or {}:
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Cannot filter on {field}, filterable fields are: {', '.join(FILTER_FIELDS)}.")
+
+    def _build_selector(self, allowed: set, excluded: set):
+        if allowed is not None:
+            return faiss.IDSelectorBatch(np.fromiter(allowed, dtype=np.int64, count=len(allowed)))
+        if excluded:
+            # IDSelectorNot does not own the wrapped selector, keep a reference to it on the outer one
+            inner = faiss.IDSelectorBatch(np.fromiter(excluded, dtype=np.int64, count=len(excluded)))
+            selector = faiss.IDSelectorNot(inner)
+            selector.inner = inner
+            return selector
+        return None
+
+    def _search_positions(self, queries: np.ndarray, k: int, filters: dict = None) -> tuple:
+        """
+        Find the positions of the k live documents closest to every query, padded with -1.
+        """
+        empty = (np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64))
+        if len(self) == 0:
+            return empty
+
+        allowed, excluded = self._filter_positions(filters)
+        if allowed is not None and not allowed:
+            return empty
+
+        if allowed is not None and self.index is not None and is_approximate(self.index) and len(allowed) <= FAISS_ANN_MIN_VECTORS:
+            # Cluster and graph based indexes lose recall under restrictive selectors, small subsets are searched exactly
+            return self._search_subset(queries, k, allowed)
+
+        # Compressed codes and truncated dimensions only approximate the distances, fetch extra candidates and re-rank them exactly
+        index_dim = self._index_dimensions(queries.shape[1])
+        exact_rerank = self.index_meta.get("compression", "none") != "none" or (index_dim < queries.shape[1] and FAISS_RERANK_FULL_DIMENSIONS)
+        fetch = k * FAISS_RERANK_FACTOR if exact_rerank else k
+        index_queries = truncate_vectors(queries, index_dim)
+
+        parts = []
+        if self.index is not None:
+            parts.append(self._search_index(self.index, 0, index_queries, fetch, allowed, excluded))
+        if self.delta is not None:
+            parts.append(self._search_index(self.delta, self._base_count(), index_queries, fetch, allowed, excluded))
+        distances, positions = self._merge_results(parts, fetch)
+        if exact_rerank:
+            return rerank(queries, positions, self.full_vectors, k)
+        return distances, positions
+
+    def _find_duplicates(self, vectors: np.ndarray, ids: list, threshold: float, excluded_ids: set = frozenset()) -> list:
+        """
+        Match every vector to the ID of a live document, other than `excluded_ids`, or earlier vector it duplicates, or None.
+        """
+        unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        # Neighbours are ranked by L2 distance, check a few of them since it only matches cosine order for unit vectors
+        _, positions = self._search_positions(vectors, DEDUP_CANDIDATES)
+        candidates = np.unique(positions[positions != -1])
+        row_of = {int(position): row for row, position in enumerate(candidates)}
+        docs = self.docstore.get_many(list(row_of))
+        if len(candidates):
+            stored = self.full_vectors.get(candidates)
+            stored = stored / np.maximum(np.linalg.norm(stored, axis=1, keepdims=True), 1e-12)
+
+        matches = []
+        for row, query_positions in enumerate(positions):
+            match = None
+            best = threshold
+            for position in query_positions[query_positions != -1]:
+                if docs[int(position)].id in excluded_ids:
+                    continue
+                similarity = float(unit[row] @ stored[row_of[int(position)]])
+                if similarity >= best:
+                    match, best = docs[int(position)].id, similarity
+            # Chunks of the same batch can repeat each other, compare with the earlier ones as well
+            if row > 0:
+                similarities = unit[:row] @ unit[row]
+                earlier = int(np.argmax(similarities))
+                if similarities[earlier] >= best:
+                    match = matches[earlier] or ids[earlier]
+            matches.append(match)
+        return matches
+
+    def _search_index(self, index, offset: int, queries: np.ndarray, k: int, allowed: set, excluded: set) -> tuple:
+        """
+        Search the index holding the positions [offset, offset + index.ntotal).
+        """
+        end = offset + index.ntotal
+        local_allowed = None
+        if allowed is not None:
+            local_allowed = {position - offset for position in allowed if offset <= position < end}
+            if not local_allowed:
+                return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+        local_excluded = {position - offset for position in excluded if offset <= position < end}
+
+        selector = self._build_selector(local_allowed, local_excluded)
+        distances, positions = index.search(queries, k, params=search_parameters(index, selector))
+        return distances, np.where(positions == -1, -1, positions + offset)
+
+    def _merge_results(self, parts: list, k: int) -> tuple:
+        distances = np.concatenate([part_distances for part_distances, _ in parts], axis=1)
+        positions = np.concatenate([part_positions for _, part_positions in parts], axis=1)
+        distances = np.where(positions == -1, np.inf, distances)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(positions, order, axis=1)
+
+    def _search_subset(self, queries: np.ndarray, k: int, allowed: set) -> tuple:
+        subset = np.fromiter(sorted(allowed), dtype=np.int64, count=len(allowed))
+        exact = faiss.IndexFlatL2(queries.shape[1])
+        exact.add(self.full_vectors.get(subset))
+        distances, subset_positions = exact.search(queries, k)
+        positions = np.where(subset_positions == -1, -1, subset[np.maximum(subset_positions, 0)])
+        return distances, positions
+
+    def _rebuild(self, vectors: np.ndarray) -> tuple:
+        # Rebuild from the full precision vectors, re-encoding already compressed codes would compound the loss
+        dim = get_index_dimensions(vectors.shape[1])
+        index, index_meta = build_index(truncate_vectors(vectors, dim), dim)
+        if "recall_at_k" in index_meta:
+            print(f"Rebuilt FAISS shard {self.index_dir} as {index_meta.get('factory', index_meta['index_type'])} over {len(vectors)} vectors, recall@k {index_meta['recall_at_k']:.3f}")
+        return index, index_meta
+
+    def _write_snapshot(self, snapshot_dir: str, index, index_meta: dict, order: list, vectors: np.ndarray, docstore: ShardDocstore) -> None:
+        """
+        Write the index, documents and full vectors of the positions in `order`, renumbered from 0.
+        """
+        faiss.write_index(index, os.path.join(snapshot_dir, INDEX_FILE))
+
+        def rows():
+            for start in range(0, len(order), LOOKUP_BATCH_SIZE):
+                batch = order[start:start + LOOKUP_BATCH_SIZE]
+                docs = docstore.get_many(batch)
+                for new_position, old_position in enumerate(batch, start):
+                    doc = docs[old_position]
+                    yield new_position, doc.id, doc.page_content, doc.metadata
+
+        ShardDocstore.write(os.path.join(snapshot_dir, DOCSTORE_FILE), rows())
+        # An uncompressed full dimension index already holds the same vectors, they are read back from it
+        if not stores_full_vectors(index, index_meta, vectors.shape[1]):
+            FullVectorStore(vectors).save(os.path.join(snapshot_dir, VECTORS_FILE))
+        with open(os.path.join(snapshot_dir, INDEX_META_FILE), "w") as f:
+            json.dump(index_meta, f)
+
+    def _iter_texts(self, docstore: ShardDocstore, order: list):
+        for start in range(0, len(order), LOOKUP_BATCH_SIZE):
+            batch = order[start:start + LOOKUP_BATCH_SIZE]
+            docs = docstore.get_many(batch)
+            yield [docs[position].id for position in batch], [docs[position].page_content for position in batch]
+
+    def _reembed_record(self, record: dict, embed) -> dict:
+        if record["op"] != "add":
+            return record
+        vectors = embed(iter([(record["ids"], record["texts"])]))
+        return {**record, "dim": vectors.shape[1], "vectors": encode_vectors(vectors)}
+
+    def _remove_snapshots(self, generation: str, keep: str) -> None:
+        """
+        Delete every snapshot but `keep`, including one written directly into the index directory.
+        """
+        if generation is not None and get_snapshot_dir(self.index_dir, generation) == self.index_dir:
+            for file_name in SNAPSHOT_FILES:
+                try:
+                    os.remove(os.path.join(self.index_dir, file_name))
+                except FileNotFoundError:
+                    pass
+        snapshots_dir = os.path.join(self.index_dir, SNAPSHOTS_DIR)
+        for name in os.listdir(snapshots_dir):
+            if name != keep:
+                shutil.rmtree(os.path.join(snapshots_dir, name), ignore_errors=True)
+
+    def _to_result(self, doc: Document) -> Document:
+        # Copy the document, a position can be returned for several queries, and expose the ID in the metadata as well
+        return Document(id=doc.id, page_content=doc.page_content, metadata={**doc.metadata, "id": doc.id})
@@ -0,0 +1,138 @@
+import base64
+import json
+import os
+import numpy as np
+
+# Bytes read at a time when looking back for the end of the last complete record
+TAIL_READ_SIZE = 65536
+
+def encode_vectors(vectors) -> str:
+    """
+    Encode a batch of embeddings as base64 float32 bytes for a WAL record.
+
+    Args:
+        vectors: A 2D array-like of embeddings.
+
+    Returns:
+        str: The base64 encoded vectors.
+    """
+    return base64.b64encode(np.asarray(vectors, dtype=np.float32).tobytes()).decode("ascii")
+
+def decode_vectors(data: str, dim: int) -> np.ndarray:
+    """
+    Decode a batch of embeddings written by `encode_vectors`.
+
+    Args:
+        data (str): The base64 encoded vectors.
+        dim (int): The dimension of each vector.
+
+    Returns:
+        np.ndarray: A (n, dim) float32 array.
+    """
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).reshape(-1, dim)
+
+class WriteAheadLog:
+    """
+    Append-only log of vector memory writes, stored as one JSON record per line.
+
+    Appending a batch costs O(batch) regardless of the size of the index. A trailing line without
+    a newline is a torn write: it is never read, and the next append truncates it before writing.
+    Appends must be serialized by the caller, e.g. under the shard's exclusive file lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def append(self, records: list) -> None:
+        """
+        Durably append records to the log.
+
+        Args:
+            records (list): The JSON serializable records to append.
+        """
+        payload = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode("utf-8")
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Drop a torn record left by a crash or a short write, so it is not glued to the new ones
+            end = self._complete_size(fd)
+            if end < os.fstat(fd).st_size:
+                os.ftruncate(fd, end)
+            view = memoryview(payload)
+            while view:
+                written = os.pwrite(fd, view, end)
+                view, end = view[written:], end + written
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _complete_size(self, fd: int) -> int:
+        """
+        Get the size of the log up to the end of its last complete record.
+
+        Args:
+            fd (int): A file descriptor of the log opened for reading.
+
+        Returns:
+            int: The offset just past the last newline, 0 if there is none.
+        """
+        end = os.fstat(fd).st_size
+        if end == 0 or os.pread(fd, 1, end - 1) == b"\n":
+            return end
+        while end > 0:
+            start = max(0, end - TAIL_READ_SIZE)
+            data = os.pread(fd, end - start, start)
+            newline = data.rfind(b"\n")
+            if newline != -1:
+                return start + newline + 1
+            end = start
+        return 0
+
+    def size(self) -> int:
+        """
+        Get the current size of the log in bytes.
+
+        Returns:
+            int: The size of the log, 0 if it does not exist.
+        """
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def read_from(self, offset: int) -> tuple:
+        """
+        Read all complete records written after an offset.
+
+        Args:
+            offset (int): The byte offset to start reading from.
+
+        Returns:
+            tuple: The list of records and the offset just past the last complete record.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+
+        end = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:end].splitlines():
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn record glued to the next one by an append predating torn write truncation
+                print(f"Skipping corrupt record in {self.path}")
+        return records, offset + end
+
+    def remove(self) -> None:
+        """
+        Delete the log file once its records have been folded into a snapshot.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
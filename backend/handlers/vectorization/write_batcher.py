@@ -0,0 +1,131 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+class WriteBatcher:
+    """
+    Coalesces concurrent memory writes into batched embedding calls and index writes.
+
+    Callers submit the chunks they want to store and wait on a future. A background thread collects
+    the chunks submitted within `window` seconds of the first one, or until `max_items` chunks are
+    pending, embeds all of them with a single embeddings call and hands each shard's chunks to
+    `write` at once, which makes a single WAL append per shard. Every future then receives the
+    results of its own chunks. Under load this trades a few milliseconds of latency for far fewer
+    embedding requests and index writes, and a batch naturally grows while the previous one is
+    being written.
+    """
+
+    def __init__(self, embeddings, write, window: float, max_items: int):
+        """
+        Args:
+            embeddings: The embedder used for the chunks, called once per batch.
+            write: A function (index_dir, texts, vectors, metadatas, replaced_ids) -> list of per chunk results.
+            window (float): The number of seconds to wait for more chunks after the first one, 0 disables coalescing.
+            max_items (int): The number of chunks that flushes a batch without waiting for the window to end.
+        """
+        self.embeddings = embeddings
+        self.write = write
+        self.window = window
+        self.max_items = max_items
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stats = {"requests": 0, "chunks": 0, "batches": 0, "shard_writes": 0}
+
+    def submit(self, index_dir: str, texts: list, metadatas: list, replaced_ids: list = None) -> Future:
+        """
+        Queue chunks to be embedded and written to a shard.
+
+        Args:
+            index_dir (str): The directory of the shard the chunks are written to.
+            texts (list): The texts of the chunks.
+            metadatas (list): The metadata of each chunk.
+            replaced_ids (list): The IDs of documents the chunks replace, deleted in the same write.
+
+        Returns:
+            Future: Resolves to the results `write` returned for these chunks, in order.
+        """
+        future = Future()
+        request = (index_dir, list(texts), list(metadatas), list(replaced_ids or []), future)
+        if self.window <= 0:
+            self._process([request])
+        else:
+            self._ensure_worker()
+            self._queue.put(request)
+        return future
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the batcher.
+
+        Returns:
+            dict: The number of requests and chunks submitted, and of batches and shard writes made for them.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="memory-write-batcher", daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            count = len(batch[0][1])
+            deadline = time.monotonic() + self.window
+            while count < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                count += len(request[1])
+            self._process(batch)
+
+    def _process(self, batch: list) -> None:
+        texts = [text for _, request_texts, _, _, _ in batch for text in request_texts]
+        try:
+            vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32) if texts else None
+        except Exception as e:
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+
+        # Group the chunks by shard, remembering which slice of the shard's results belongs to which request
+        shards = OrderedDict()
+        offset = 0
+        for index_dir, request_texts, request_metadatas, request_replaced_ids, future in batch:
+            group = shards.setdefault(index_dir, {"texts": [], "rows": [], "metadatas": [], "replaced_ids": [], "requests": []})
+            start = len(group["texts"])
+            group["texts"].extend(request_texts)
+            group["metadatas"].extend(request_metadatas)
+            group["replaced_ids"].extend(request_replaced_ids)
+            group["rows"].extend(range(offset, offset + len(request_texts)))
+            group["requests"].append((future, start, start + len(request_texts)))
+            offset += len(request_texts)
+
+        for index_dir, group in shards.items():
+            try:
+                group_vectors = vectors[group["rows"]] if group["texts"] else None
+                results = self.write(index_dir, group["texts"], group_vectors, group["metadatas"], group["replaced_ids"]) if group["texts"] or group["replaced_ids"] else []
+            except Exception as e:
+                for future, _, _ in group["requests"]:
+                    future.set_exception(e)
+                continue
+            for future, start, end in group["requests"]:
+                future.set_result(results[start:end])
+
+        with self._lock:
+            self._stats["requests"] += len(batch)
+            self._stats["chunks"] += len(texts)
+            self._stats["batches"] += 1
+            self._stats["shard_writes"] += len(shards)
@@ -0,0 +1,195 @@
+"""
+Report the recall and latency of truncated index dimensions on the stored memories, and rebuild
+every shard with the configured FAISS_INDEX_DIMENSIONS.
+
+The report uses the shards' own embeddings: a sample of stored vectors is used as queries, and
+the exact full dimension neighbours of every query are compared with the neighbours found in an
+index of the truncated vectors, with and without re-ranking `k * FAISS_RERANK_FACTOR` candidates
+with the full vectors.
+
+Usage (from the backend directory):
+    python -m scripts.migrate_index_dimensions --report --dimensions 128,256,512
+    FAISS_INDEX_DIMENSIONS=256 python -m scripts.migrate_index_dimensions --apply
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import json
+import os
+import time
+import faiss
+import numpy as np
+from handlers.vectorization.faiss_handler import SHARDS_DIR, get_shard_dir
+from handlers.vectorization.index_manager import index_manager
+from handlers.vectorization.index_factory import get_index_dimensions, truncate_vectors, rerank
+from handlers.vectorization.full_vectors import FullVectorStore
+from utils.env_vars import FAISS_INDEX_DIMENSIONS, FAISS_RERANK_FACTOR
+
+def list_user_ids() -> list:
+    """
+    List the users that have a shard.
+
+    Returns:
+        list: The user IDs, as the names of their shard directories.
+    """
+    if not os.path.isdir(SHARDS_DIR):
+        return []
+    return sorted(name for name in os.listdir(SHARDS_DIR) if os.path.isdir(os.path.join(SHARDS_DIR, name)))
+
+def load_vectors(user_ids: list, max_vectors: int) -> np.ndarray:
+    """
+    Read the full precision vectors of the given shards.
+
+    Args:
+        user_ids (list): The users whose shards are read.
+        max_vectors (int): Stop once this many vectors have been read.
+
+    Returns:
+        np.ndarray: A (n, dim) float32 array.
+    """
+    parts, total = [], 0
+    for user_id in user_ids:
+        shard = index_manager.get_shard(get_shard_dir(user_id))
+        with shard.lock:
+            if shard.size == 0:
+                continue
+            count = min(shard.size, max_vectors - total)
+            parts.append(np.array(shard.full_vectors.get(np.arange(count))))
+        total += count
+        if total >= max_vectors:
+            break
+    return np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+def neighbours(index, queries: np.ndarray, k: int) -> tuple:
+    # Every query is a stored vector, search one extra neighbour and drop the query itself
+    started = time.perf_counter()
+    distances, positions = index.search(queries, k + 1)
+    return distances, positions, time.perf_counter() - started
+
+def without_self(positions: np.ndarray, query_positions: np.ndarray, k: int) -> list:
+    return [[position for position in row if position != own][:k] for row, own in zip(positions, query_positions)]
+
+def recall(expected: list, found: list) -> float:
+    hits = sum(len(set(expected_row) & set(found_row)) for expected_row, found_row in zip(expected, found))
+    return hits / max(1, sum(len(row) for row in expected))
+
+def report(vectors: np.ndarray, dimensions: list, k: int, queries: int, rerank_factor: int) -> list:
+    """
+    Measure the recall@k and search latency of every truncated dimension against full dimension exact search.
+
+    Args:
+        vectors (np.ndarray): The stored vectors.
+        dimensions (list): The index dimensions to evaluate.
+        k (int): The number of neighbours compared.
+        queries (int): The number of stored vectors used as queries.
+        rerank_factor (int): The number of candidates fetched per result when re-ranking.
+
+    Returns:
+        list: One result dict per dimension.
+    """
+    full_dim = vectors.shape[1]
+    query_positions = np.random.default_rng(0).permutation(len(vectors))[:queries]
+    query_vectors = vectors[query_positions]
+
+    exact = faiss.IndexFlatL2(full_dim)
+    exact.add(vectors)
+    _, expected, full_seconds = neighbours(exact, query_vectors, k)
+    expected = without_self(expected, query_positions, k)
+    full_vectors = FullVectorStore(vectors)
+
+    results = []
+    for dim in sorted({get_index_dimensions(full_dim, dim) for dim in dimensions}):
+        index = faiss.IndexFlatL2(dim)
+        index.add(truncate_vectors(vectors, dim))
+        truncated_queries = truncate_vectors(query_vectors, dim)
+        _, found, seconds = neighbours(index, truncated_queries, k)
+
+        started = time.perf_counter()
+        _, candidates = index.search(truncated_queries, k * rerank_factor + 1)
+        _, reranked = rerank(query_vectors, candidates, full_vectors, k + 1)
+        rerank_seconds = time.perf_counter() - started
+
+        results.append({
+            "dimensions": dim,
+            "index_bytes": vectors.shape[0] * dim * 4,
+            "recall": recall(expected, without_self(found, query_positions, k)),
+            "recall_reranked": recall(expected, without_self(reranked, query_positions, k)),
+            "search_ms": 1000 * seconds / len(query_vectors),
+            "rerank_search_ms": 1000 * rerank_seconds / len(query_vectors),
+            "full_search_ms": 1000 * full_seconds / len(query_vectors),
+        })
+    return results
+
+def migrate(user_ids: list) -> dict:
+    """
+    Rebuild the shards whose index dimension differs from FAISS_INDEX_DIMENSIONS.
+
+    Args:
+        user_ids (list): The users whose shards are migrated.
+
+    Returns:
+        dict: The old and new index dimension of every rebuilt shard, by user ID.
+    """
+    migrated = {}
+    for user_id in user_ids:
+        shard = index_manager.get_shard(get_shard_dir(user_id))
+        if shard.index is None or shard.size == 0:
+            continue
+        before = shard.index.d
+        target = get_index_dimensions(shard.full_vectors.dim)
+        if before == target:
+            continue
+        # Compaction rebuilds the index from the full precision vectors at the configured dimension,
+        # after any compaction another worker is running
+        shard.compact(wait=True)
+        shard.refresh()
+        if shard.index.d != target:
+            print(f"Skipped the shard of user {user_id}: its index still has {shard.index.d} dimensions instead of {target}, run the migration again.")
+            continue
+        migrated[user_id] = (before, shard.index.d)
+        print(f"Rebuilt the shard of user {user_id} from {before} to {shard.index.d} dimensions.")
+    return migrated
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--report", action="store_true", help="Measure recall and latency of truncated dimensions")
+    parser.add_argument("--apply", action="store_true", help="Rebuild every shard with FAISS_INDEX_DIMENSIONS")
+    parser.add_argument("--dimensions", default="128,256,512,0", help="Comma separated index dimensions to report on, 0 is the full dimension")
+    parser.add_argument("--users", help="Comma separated user IDs, every shard by default")
+    parser.add_argument("--max-vectors", type=int, default=100000, help="Number of stored vectors the report reads at most")
+    parser.add_argument("--queries", type=int, default=500, help="Number of stored vectors used as queries")
+    parser.add_argument("-k", type=int, default=10, help="Number of neighbours compared for recall")
+    parser.add_argument("--rerank-factor", type=int, default=FAISS_RERANK_FACTOR, help="Candidates fetched per result when re-ranking")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+    if not args.report and not args.apply:
+        parser.error("Pass --report, --apply or both.")
+
+    user_ids = args.users.split(",") if args.users else list_user_ids()
+
+    if args.report:
+        vectors = load_vectors(user_ids, args.max_vectors)
+        if len(vectors) <= args.k:
+            print("Not enough stored vectors to report on.")
+        else:
+            results = report(vectors, [int(dim) for dim in args.dimensions.split(",")], args.k, args.queries, args.rerank_factor)
+            print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, recall@{args.k}, re-rank x{args.rerank_factor}")
+            print(f"{'dims':>6}{'index MiB':>11}{'recall':>8}{'reranked':>10}{'ms/q':>8}{'rr ms/q':>9}{'full ms/q':>11}")
+            for result in results:
+                print(
+                    f"{result['dimensions']:>6}{result['index_bytes'] / 2**20:>11.1f}{result['recall']:>8.3f}"
+                    f"{result['recall_reranked']:>10.3f}{result['search_ms']:>8.3f}{result['rerank_search_ms']:>9.3f}"
+                    f"{result['full_search_ms']:>11.3f}"
+                )
+            if args.json:
+                with open(args.json, "w") as f:
+                    json.dump({"args": vars(args), "vectors": len(vectors), "results": results}, f, indent=2)
+
+    if args.apply:
+        print(f"Migrating {len(user_ids)} shards to FAISS_INDEX_DIMENSIONS={FAISS_INDEX_DIMENSIONS or 'full'}.")
+        migrate(user_ids)
+
+if __name__ == "__main__":
+    main()
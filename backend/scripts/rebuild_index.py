@@ -0,0 +1,391 @@
+"""
+Rebuild the vector memory of every user from durable storage, e.g. after switching embedding models.
+
+Every shard's documents are embedded again with the configured EMBEDDING_BACKEND and
+EMBEDDING_DIMENSIONS, several requests in flight at a time under requests and tokens per minute
+limits. A fresh snapshot is built from the new embeddings and published by atomically swapping the
+shard's CURRENT pointer, the memories written meanwhile being embedded again during the swap, so
+the API keeps serving the old snapshot until the new one is complete.
+
+The chunks of ingested documents are also stored in the `chunks` table. Users whose shard is
+missing or empty get their chunks restored from it, read in keyset paginated batches.
+--restore-chunks restores the chunks missing from every shard, which also brings back the chunks
+of memories deleted since they were ingested.
+
+Progress is checkpointed in FAISS_INDEX_DIR/rebuild: every batch of embeddings as it arrives, the
+users already rebuilt and the last chunk restored. Running the command again after a crash or an
+interruption resumes where it stopped without embedding anything twice.
+
+Workers still running with the previous embedding settings keep embedding new memories with the
+old model, restart them with the new settings once the rebuild is done.
+
+Usage (from the backend directory):
+    EMBEDDING_DIMENSIONS=512 python -m scripts.rebuild_index --concurrency 4 --rpm 3000 --tpm 1000000
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import timezone
+import numpy as np
+from handlers.vectorization.async_embeddings import AsyncEmbeddings
+from handlers.vectorization.embedders import embedder, unwrap_embeddings
+from handlers.vectorization.faiss_handler import SHARDS_DIR, get_shard_dir
+from handlers.vectorization.index_manager import index_manager
+from handlers.vectorization.rate_limit import RateLimiter, estimate_tokens
+from handlers.vectorization.wal import WriteAheadLog, encode_vectors, decode_vectors
+from utils.env_vars import FAISS_INDEX_DIR, EMBEDDING_BACKEND, EMBEDDING_DIMENSIONS
+
+REBUILD_DIR = os.path.join(FAISS_INDEX_DIR, "rebuild")
+CHECKPOINT_FILE = os.path.join(REBUILD_DIR, "checkpoint.json")
+SOURCES = ("shards", "chunks")
+# Attempts of an embedding request before the rebuild stops, waiting twice as long after every failure
+MAX_ATTEMPTS = 6
+RETRY_DELAY = 1.0
+
+class Checkpoint:
+    """
+    Progress of a rebuild that survives crashes: the embedding settings it was started with, the
+    users already rebuilt, and per user whether its chunks are restored and the last one restored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path, "r") as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {"embedding": get_embedding_settings(), "done": [], "users": {}}
+
+    def user(self, user_id: str) -> dict:
+        return self.state["users"].setdefault(user_id, {})
+
+    def save(self) -> None:
+        """
+        Atomically replace the checkpoint file.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+class VectorCheckpoint:
+    """
+    The embeddings computed so far for one user, appended to a log as every batch arrives.
+    """
+
+    def __init__(self, path: str):
+        self.log = WriteAheadLog(path)
+        self.vectors = {}
+        records, _ = self.log.read_from(0)
+        for record in records:
+            for doc_id, vector in zip(record["ids"], decode_vectors(record["vectors"], record["dim"])):
+                self.vectors[doc_id] = vector
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.vectors
+
+    def add(self, ids: list, vectors: np.ndarray) -> None:
+        self.log.append([{"ids": ids, "dim": vectors.shape[1], "vectors": encode_vectors(vectors)}])
+        self.vectors.update(zip(ids, vectors))
+
+    def get(self, ids: list) -> np.ndarray:
+        return np.stack([self.vectors[doc_id] for doc_id in ids])
+
+    def remove(self) -> None:
+        self.log.remove()
+
+class EmbeddingClient:
+    """
+    Embeds a stream of texts in batches, keeping several requests in flight within the
+    requests and tokens per minute budgets, and retrying failed requests with exponential backoff.
+
+    The `openai_async` embedder already batches, rate limits and retries its requests within the
+    EMBEDDING_* limits, so with it the budgets and retries of the client are left to the embedder.
+    """
+
+    def __init__(self, embeddings, batch_size: int, concurrency: int, rpm: float, tpm: float):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.managed = isinstance(unwrap_embeddings(embeddings), AsyncEmbeddings)
+        self.requests = RateLimiter(0 if self.managed else rpm)
+        self.tokens = RateLimiter(0 if self.managed else tpm)
+        self.max_attempts = 1 if self.managed else MAX_ATTEMPTS
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="rebuild-embeddings")
+        self.stats = {"requests": 0, "texts": 0, "retries": 0}
+        self._lock = threading.Lock()
+
+    def embed_batch(self, texts: list) -> np.ndarray:
+        """
+        Embed one batch of texts, waiting for the rate limits and retrying failures.
+
+        Args:
+            texts (list): The texts.
+
+        Returns:
+            np.ndarray: A (n, dim) float32 array.
+        """
+        delay = RETRY_DELAY
+        for attempt in range(self.max_attempts):
+            self.requests.acquire()
+            self.tokens.acquire(sum(estimate_tokens(text) for text in texts))
+            try:
+                vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+                with self._lock:
+                    self.stats["requests"] += 1
+                    self.stats["texts"] += len(texts)
+                return vectors
+            except Exception as e:
+                if attempt == self.max_attempts - 1:
+                    raise
+                print(f"Error embedding {len(texts)} texts, retrying in {delay:.0f}s: {e}")
+                with self._lock:
+                    self.stats["retries"] += 1
+                time.sleep(delay)
+                delay *= 2
+
+    def embed_stream(self, items):
+        """
+        Embed (ID, text) pairs in batches of `batch_size`, `concurrency` batches at a time.
+
+        Args:
+            items: An iterable of (ID, text) tuples, consumed as requests complete.
+
+        Yields:
+            tuple: (IDs, (n, dim) embeddings) of every batch, in the order of `items`.
+        """
+        pending = deque()
+
+        def batches():
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        for batch in batches():
+            ids = [doc_id for doc_id, _ in batch]
+            pending.append((ids, self.executor.submit(self.embed_batch, [text for _, text in batch])))
+            if len(pending) >= self.concurrency:
+                ids, future = pending.popleft()
+                yield ids, future.result()
+        while pending:
+            ids, future = pending.popleft()
+            yield ids, future.result()
+
+def get_embedding_settings() -> str:
+    return f"{EMBEDDING_BACKEND}:{EMBEDDING_DIMENSIONS}"
+
+def list_shard_user_ids() -> list:
+    if not os.path.isdir(SHARDS_DIR):
+        return []
+    return sorted(name for name in os.listdir(SHARDS_DIR) if os.path.isdir(os.path.join(SHARDS_DIR, name)))
+
+def list_chunk_user_ids() -> list:
+    from models import db
+    from models.chunk import Chunk
+    return sorted(str(user_id) for user_id, in db.session.query(Chunk.user_id).distinct())
+
+def iter_chunk_rows(user_id: str, after_id: int, batch_size: int):
+    """
+    Read the chunks of a user in keyset paginated batches, so that no batch rescans the previous ones.
+
+    Args:
+        user_id (str): The ID of the user.
+        after_id (int): Only chunks with a greater ID are read.
+        batch_size (int): The number of chunks per batch.
+
+    Yields:
+        list: (Chunk, document source) tuples, by increasing chunk ID.
+    """
+    from models import db
+    from models.chunk import Chunk
+    from models.document import Document
+    while True:
+        rows = (
+            db.session.query(Chunk, Document.source)
+            .join(Document, Chunk.document_id == Document.id)
+            .filter(Chunk.user_id == int(user_id), Chunk.id > after_id)
+            .order_by(Chunk.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0].id
+
+def reembed_shard(shard, vectors: VectorCheckpoint, client: EmbeddingClient) -> bool:
+    """
+    Rebuild a shard from new embeddings, reusing the checkpointed ones.
+
+    Args:
+        shard (VectorShard): The shard.
+        vectors (VectorCheckpoint): The embeddings already computed for the shard.
+        client (EmbeddingClient): The embedding client.
+
+    Returns:
+        bool: True if a new snapshot was published.
+    """
+    def embed(batches) -> np.ndarray:
+        order = []
+
+        def missing():
+            for ids, texts in batches:
+                order.extend(ids)
+                yield from ((doc_id, text) for doc_id, text in zip(ids, texts) if doc_id not in vectors)
+
+        for ids, batch_vectors in client.embed_stream(missing()):
+            vectors.add(ids, batch_vectors)
+        return vectors.get(order)
+
+    return shard.reembed(embed)
+
+def restore_chunks(user_id: str, shard, checkpoint: Checkpoint, client: EmbeddingClient, batch_size: int) -> int:
+    """
+    Add the chunks of a user that are missing from its shard, embedded anew.
+
+    Args:
+        user_id (str): The ID of the user.
+        shard (VectorShard): The user's shard.
+        checkpoint (Checkpoint): The rebuild checkpoint, holding the last chunk restored.
+        client (EmbeddingClient): The embedding client.
+        batch_size (int): The number of chunks read per query.
+
+    Returns:
+        int: The number of restored memories.
+    """
+    state = checkpoint.user(user_id)
+    restored = 0
+    for rows in iter_chunk_rows(user_id, state.get("last_chunk_id", 0), batch_size):
+        # Chunks ingested as duplicates point to the same memory, it is restored once
+        documents = {}
+        for chunk, source in rows:
+            info = chunk.additional_info or {}
+            memory_id = info.get("memory_id") or f"chunk-{chunk.id}"
+            documents.setdefault(memory_id, (chunk.text, {
+                "source": source or "document",
+                "user_id": chunk.user_id,
+                "document_id": chunk.document_id,
+                "page": info.get("page"),
+                "chunk_index": chunk.chunk_index,
+                "created_at": chunk.created_at.replace(tzinfo=timezone.utc).isoformat(),
+            }))
+
+        existing = {doc.id for doc in shard.get_documents(list(documents))}
+        missing = [(memory_id, text) for memory_id, (text, _) in documents.items() if memory_id not in existing]
+        for ids, vectors in client.embed_stream(missing):
+            shard.add([documents[memory_id][0] for memory_id in ids], vectors, [documents[memory_id][1] for memory_id in ids], ids=ids)
+            restored += len(ids)
+
+        state["last_chunk_id"] = rows[-1][0].id
+        checkpoint.save()
+    return restored
+
+def rebuild(user_ids: list, sources: list, client: EmbeddingClient, checkpoint: Checkpoint, restore_all: bool, chunk_batch_size: int) -> None:
+    """
+    Rebuild the shards of the given users, skipping those the checkpoint marks as done.
+
+    Args:
+        user_ids (list): The users to rebuild.
+        sources (list): The sources to rebuild from, among SOURCES.
+        client (EmbeddingClient): The embedding client.
+        checkpoint (Checkpoint): The rebuild checkpoint.
+        restore_all (bool): Whether to restore missing chunks into every shard, not only missing or empty ones.
+        chunk_batch_size (int): The number of chunks read per query.
+    """
+    for number, user_id in enumerate(user_ids, 1):
+        if user_id in checkpoint.state["done"]:
+            continue
+        started = time.perf_counter()
+        shard = index_manager.get_shard(get_shard_dir(user_id))
+        state = checkpoint.user(user_id)
+        if "restore_chunks" not in state:
+            # Decided once, a shard filled by an interrupted restore must still be restored when resuming
+            state["restore_chunks"] = "chunks" in sources and (restore_all or len(shard) == 0)
+            checkpoint.save()
+
+        vectors = VectorCheckpoint(os.path.join(REBUILD_DIR, f"{user_id}.log"))
+        reembedded = "shards" in sources and reembed_shard(shard, vectors, client)
+        restored = restore_chunks(user_id, shard, checkpoint, client, chunk_batch_size) if state["restore_chunks"] else 0
+        if restored:
+            shard.compact()
+
+        checkpoint.state["done"].append(user_id)
+        checkpoint.save()
+        vectors.remove()
+        print(
+            f"[{number}/{len(user_ids)}] User {user_id}: {len(shard)} memories, "
+            f"{'re-embedded' if reembedded else 'not re-embedded'}, {restored} restored from chunks, "
+            f"{time.perf_counter() - started:.1f}s, {client.stats['requests']} requests so far"
+        )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sources", default=",".join(SOURCES), help="Comma separated sources: shards, chunks or both")
+    parser.add_argument("--users", help="Comma separated user IDs, every user by default")
+    parser.add_argument("--restore-chunks", action="store_true", help="Restore the chunks missing from every shard, not only from missing or empty ones")
+    parser.add_argument("--batch-size", type=int, default=256, help="Texts per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Embedding requests in flight")
+    parser.add_argument("--rpm", type=float, default=3000, help="Embedding requests per minute, 0 for no limit, ignored with openai_async")
+    parser.add_argument("--tpm", type=float, default=1000000, help="Embedding tokens per minute, 0 for no limit, ignored with openai_async")
+    parser.add_argument("--chunk-batch-size", type=int, default=1000, help="Chunks read per database query")
+    parser.add_argument("--restart", action="store_true", help="Discard the checkpoint of a previous run")
+    args = parser.parse_args()
+
+    sources = [source.strip() for source in args.sources.split(",") if source.strip()]
+    for source in sources:
+        if source not in SOURCES:
+            parser.error(f"Invalid source {source}, supported sources are: {', '.join(SOURCES)}.")
+
+    if args.restart:
+        shutil.rmtree(REBUILD_DIR, ignore_errors=True)
+    checkpoint = Checkpoint(CHECKPOINT_FILE)
+    if checkpoint.state["embedding"] != get_embedding_settings():
+        print(f"Error: the checkpoint in {REBUILD_DIR} was made with embedding settings {checkpoint.state['embedding']}, not {get_embedding_settings()}. Run with --restart to discard it.")
+        return
+    checkpoint.save()
+
+    # Only the chunks source needs the database
+    if "chunks" in sources:
+        from app import create_app
+        context = create_app().app_context()
+    else:
+        context = nullcontext()
+
+    client = EmbeddingClient(embedder, args.batch_size, args.concurrency, args.rpm, args.tpm)
+    if client.managed:
+        print("The openai_async embedder applies the EMBEDDING_* rate limits and retries, --rpm and --tpm are ignored.")
+    with context:
+        if args.users:
+            user_ids = args.users.split(",")
+        else:
+            user_ids = set(list_shard_user_ids())
+            if "chunks" in sources:
+                user_ids.update(list_chunk_user_ids())
+            user_ids = sorted(user_ids)
+        print(f"Rebuilding {len(user_ids)} users from {', '.join(sources)} with {get_embedding_settings()} embeddings.")
+        rebuild(user_ids, sources, client, checkpoint, args.restore_chunks, args.chunk_batch_size)
+
+    if not args.users:
+        shutil.rmtree(REBUILD_DIR, ignore_errors=True)
+    print(f"Done: {client.stats['texts']} texts embedded with {client.stats['requests']} requests, {client.stats['retries']} retries.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Split the legacy global FAISS index into one shard per user.
+
+Before sharding every user's memories lived in a single index directly under FAISS_INDEX_DIR.
+This script groups the stored vectors by the `user_id` metadata field, writes each group to the
+user's shard (appending to anything the shard already contains) and moves the global index into
+FAISS_INDEX_DIR/legacy so that it is not picked up again. Vectors are copied, never re-embedded.
+
+Usage (from the backend directory):
+    python -m scripts.split_faiss_index
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import os
+import shutil
+from collections import defaultdict
+from langchain_community.vectorstores import FAISS
+from handlers.vectorization.embedders import embedder
+from handlers.vectorization.index_manager import index_manager
+from handlers.vectorization.vector_shard import INDEX_FILE, LEGACY_DOCSTORE_FILE, VERSION_FILE
+from handlers.vectorization.faiss_handler import get_shard_dir
+from utils.env_vars import FAISS_INDEX_DIR
+
+LEGACY_DIR = os.path.join(FAISS_INDEX_DIR, "legacy")
+
+def split_global_index() -> dict:
+    """
+    Split the global index into per-user shards.
+
+    Returns:
+        dict: The number of migrated vectors per user ID.
+    """
+    if not os.path.exists(os.path.join(FAISS_INDEX_DIR, INDEX_FILE)):
+        print(f"No global index found in {FAISS_INDEX_DIR}, nothing to migrate.")
+        return {}
+
+    global_index = FAISS.load_local(FAISS_INDEX_DIR, embedder, allow_dangerous_deserialization=True)
+
+    groups = defaultdict(list)
+    for position, doc_id in global_index.index_to_docstore_id.items():
+        doc = global_index.docstore.search(doc_id)
+        user_id = doc.metadata.get("user_id")
+        if user_id is None:
+            print(f"Skipping document {doc_id} without a user_id.")
+            continue
+        groups[user_id].append((position, doc_id, doc))
+
+    migrated = {}
+    for user_id, entries in groups.items():
+        shard = index_manager.get_shard(get_shard_dir(user_id))
+        with shard.lock:
+            existing_ids = {doc.id for doc in shard.get_documents([doc_id for _, doc_id, _ in entries])}
+            entries = [entry for entry in entries if entry[1] not in existing_ids]
+            if not entries:
+                continue
+
+            texts = [doc.page_content for _, _, doc in entries]
+            vectors = [global_index.index.reconstruct(position) for position, _, _ in entries]
+            metadatas = [doc.metadata for _, _, doc in entries]
+            ids = [doc_id for _, doc_id, _ in entries]
+
+            shard.add(texts, vectors, metadatas, ids=ids)
+            shard.compact()
+
+        migrated[user_id] = len(entries)
+        print(f"Migrated {len(entries)} vectors for user {user_id}.")
+
+    os.makedirs(LEGACY_DIR, exist_ok=True)
+    for file_name in (INDEX_FILE, LEGACY_DOCSTORE_FILE, VERSION_FILE):
+        path = os.path.join(FAISS_INDEX_DIR, file_name)
+        if os.path.exists(path):
+            shutil.move(path, os.path.join(LEGACY_DIR, file_name))
+    print(f"Moved the global index to {LEGACY_DIR}.")
+
+    return migrated
+
+if __name__ == "__main__":
+    split_global_index()
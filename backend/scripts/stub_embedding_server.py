@@ -0,0 +1,164 @@
+"""
+Serve a local stand-in of the OpenAI embeddings endpoint, to test and load-test the embedding clients offline.
+
+POST /v1/embeddings answers like the OpenAI API with deterministic `hashing` embeddings of the
+inputs, after a configurable latency. It can reject requests beyond a requests per minute budget
+with 429 and a Retry-After header, and fail a share of requests with 500, so the backoff of the
+clients can be exercised. GET /stats returns the number of requests served, rejected and failed,
+and the highest number of requests handled at once.
+
+Usage (from the backend directory):
+    python -m scripts.stub_embedding_server --port 8089 --latency-ms 50 --rpm 600
+    EMBEDDING_BACKEND=openai_async EMBEDDING_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub CHUNKER_MODE=characters python app.py
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# The embedders module creates the configured embedder when imported, the stub itself needs no OpenAI credentials
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+
+from handlers.vectorization.embedders import HashingEmbeddings, HASHING_DEFAULT_DIMENSIONS
+from handlers.vectorization.rate_limit import RateLimiter
+
+class StubState:
+    def __init__(self, args):
+        self.args = args
+        self.requests = RateLimiter(args.rpm)
+        self.lock = threading.Lock()
+        self.embedders = {}
+        self.in_flight = 0
+        self.stats = {"requests": 0, "rate_limited": 0, "failed": 0, "inputs": 0, "max_in_flight": 0}
+
+    def embedder(self, dimensions: int) -> HashingEmbeddings:
+        with self.lock:
+            if dimensions not in self.embedders:
+                self.embedders[dimensions] = HashingEmbeddings(dimensions)
+            return self.embedders[dimensions]
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += amount
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.state.lock:
+                self.send_json(200, dict(self.state.stats))
+        else:
+            self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        args = self.state.args
+        wait = self.state.requests.reserve(1)
+        if wait > 0:
+            # Rejected requests do not consume the budget
+            self.state.requests.reserve(-1)
+            self.state.count("rate_limited")
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"Retry-After": f"{wait:.3f}"})
+            return
+        if random.random() < args.error_rate:
+            self.state.count("failed")
+            self.send_json(500, {"error": {"message": "Injected failure", "type": "server_error"}})
+            return
+
+        inputs = body.get("input", [])
+        inputs = [inputs] if isinstance(inputs, (str, int)) or (inputs and isinstance(inputs[0], int)) else inputs
+        # Token arrays, as sent by LangChain's client, are embedded through their text form
+        texts = [text if isinstance(text, str) else " ".join(map(str, text)) for text in inputs]
+        if not texts or len(texts) > args.max_inputs:
+            self.send_json(400, {"error": {"message": f"Send between 1 and {args.max_inputs} inputs", "type": "invalid_request_error"}})
+            return
+
+        with self.state.lock:
+            self.state.in_flight += 1
+            self.state.stats["max_in_flight"] = max(self.state.stats["max_in_flight"], self.state.in_flight)
+        try:
+            time.sleep(args.latency_ms / 1000 + args.ms_per_input * len(texts) / 1000)
+            vectors = self.state.embedder(body.get("dimensions") or args.dim).embed_documents(texts)
+        finally:
+            with self.state.lock:
+                self.state.in_flight -= 1
+
+        if body.get("encoding_format") == "base64":
+            data = [base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii") for vector in vectors]
+        else:
+            data = vectors
+        tokens = sum(len(text.split()) for text in texts)
+        self.state.count("requests")
+        self.state.count("inputs", len(texts))
+        self.send_json(200, {
+            "object": "list",
+            "data": [{"object": "embedding", "index": position, "embedding": vector} for position, vector in enumerate(data)],
+            "model": body.get("model", "stub"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def send_json(self, status: int, payload: dict, headers: dict = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            super().log_message(format, *args)
+
+def serve(args) -> ThreadingHTTPServer:
+    """
+    Start the stub server in a background thread.
+
+    Args:
+        args: The parsed command line arguments.
+
+    Returns:
+        ThreadingHTTPServer: The running server, stopped with `shutdown()`.
+    """
+    handler = type("Handler", (StubHandler,), {"state": StubState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-embedding-server", daemon=True).start()
+    return server
+
+def parse_args(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8089, help="Port to listen on, 0 picks a free one")
+    parser.add_argument("--dim", type=int, default=HASHING_DEFAULT_DIMENSIONS, help="Embedding dimension when the request sets none")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Latency of every request")
+    parser.add_argument("--ms-per-input", type=float, default=0.05, help="Additional latency per input of a request")
+    parser.add_argument("--rpm", type=float, default=0, help="Requests per minute served before answering 429, 0 for no limit")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests failed with 500")
+    parser.add_argument("--max-inputs", type=int, default=2048, help="Maximum number of inputs per request")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser.parse_args(argv)
+
+def main() -> None:
+    args = parse_args()
+    server = serve(args)
+    print(f"Stub embeddings endpoint listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
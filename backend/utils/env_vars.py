@@ -2,5 +2,47 @@ import os
 
 DEV_ENV = os.getenv("DEV_ENV", "False").lower() in ("true", "1", "yes")
 FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "./faiss_index")
+FAISS_MAX_OPEN_SHARDS = int(os.getenv("FAISS_MAX_OPEN_SHARDS", "64"))
+FAISS_WAL_COMPACT_BYTES = int(os.getenv("FAISS_WAL_COMPACT_BYTES", str(8 * 1024 * 1024)))
+FAISS_COMPACT_INTERVAL = float(os.getenv("FAISS_COMPACT_INTERVAL", "60"))
+FAISS_TOMBSTONE_COMPACT_RATIO = float(os.getenv("FAISS_TOMBSTONE_COMPACT_RATIO", "0.2"))
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+EMBEDDING_BASE_URL = os.getenv("EMBEDDING_BASE_URL", "")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "512"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+EMBEDDING_MAX_IN_FLIGHT = int(os.getenv("EMBEDDING_MAX_IN_FLIGHT", "8"))
+EMBEDDING_RPM = float(os.getenv("EMBEDDING_RPM", "3000"))
+EMBEDDING_TPM = float(os.getenv("EMBEDDING_TPM", "1000000"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+FAISS_ANN_MIN_VECTORS = int(os.getenv("FAISS_ANN_MIN_VECTORS", "10000"))
+FAISS_RETRAIN_GROWTH = float(os.getenv("FAISS_RETRAIN_GROWTH", "2"))
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "0"))
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "80"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+FAISS_COMPRESSION = os.getenv("FAISS_COMPRESSION", "none").lower()
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "0"))
+FAISS_RERANK_FACTOR = int(os.getenv("FAISS_RERANK_FACTOR", "4"))
+FAISS_INDEX_DIMENSIONS = int(os.getenv("FAISS_INDEX_DIMENSIONS", "0"))
+FAISS_RERANK_FULL_DIMENSIONS = os.getenv("FAISS_RERANK_FULL_DIMENSIONS", "True").lower() in ("true", "1", "yes")
+FAISS_MMAP_INDEX = os.getenv("FAISS_MMAP_INDEX", "True").lower() in ("true", "1", "yes")
+MEMORY_SEARCH_MODE = os.getenv("MEMORY_SEARCH_MODE", "hybrid").lower()
+MEMORY_DEDUP_THRESHOLD = float(os.getenv("MEMORY_DEDUP_THRESHOLD", "0.97"))
+MEMORY_DEDUP_MODE = os.getenv("MEMORY_DEDUP_MODE", "merge").lower()
+MEMORY_WRITE_BATCH_WINDOW_MS = float(os.getenv("MEMORY_WRITE_BATCH_WINDOW_MS", "5"))
+MEMORY_WRITE_BATCH_SIZE = int(os.getenv("MEMORY_WRITE_BATCH_SIZE", "256"))
+CHUNKER_MODE = os.getenv("CHUNKER_MODE", "auto").lower()
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+CHUNK_SOURCE_SIZES = os.getenv("CHUNK_SOURCE_SIZES", "user_input:128:16")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "128"))
+INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", "2"))
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", "0"))
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 RESTRICT_LLMS = os.getenv("RESTRICT_LLMS", "True").lower() in ("true", "1", "yes")
\ No newline at end of file